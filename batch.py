@@ -0,0 +1,123 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import image_pipeline
+import settings
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+
+# 將目錄或萬用字元展開成影像路徑清單
+def collect_images(inputs):
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for name in sorted(os.listdir(item)):
+                if name.lower().endswith(IMAGE_EXTS):
+                    paths.append(os.path.join(item, name))
+        else:
+            paths.extend(sorted(glob.glob(item)))
+    return paths
+
+
+# 在子行程中處理單張影像，只回傳統計結果
+def process_image(path, params):
+    frame = cv2.imread(path)
+    if frame is None:
+        return {'image': path, 'error': 'cannot read image'}
+
+    values = (params['binary'], params['blur'], params['dilate'], params['erode'])
+    rois = params.get('rois')
+    scale = params.get('scale', 1)
+    full_res_mean = params.get('full_res_mean', True)
+    if rois:
+        # 只處理設定檔中的 ROI，另外輸出每個 ROI 的均值
+        _, roi_stats = image_pipeline.process_rois(frame, 0, values, rois, {}, scale=scale,
+                                                   full_res_mean=full_res_mean)
+        stats = np.concatenate(roi_stats)
+        roi_means = [image_pipeline.total_mean(s) for s in roi_stats]
+    else:
+        _, stats = image_pipeline.analyze(frame, values, scale, full_res_mean=full_res_mean)
+        roi_means = None
+    result = {
+        'image': path,
+        'contours': [dict(zip(stats.dtype.names, row)) for row in stats.tolist()],
+        'total_mean': image_pipeline.total_mean(stats),
+    }
+    if roi_means is not None:
+        result['roi_means'] = roi_means
+    return result
+
+
+# CSV 每個輪廓一列，沒有輪廓的影像也保留一列
+class CsvWriter:
+    FIELDS = ['image', 'contour', 'x', 'y', 'w', 'h', 'area', 'mean', 'total_mean', 'error']
+
+    def __init__(self, fp):
+        self.writer = csv.DictWriter(fp, fieldnames=self.FIELDS)
+        self.writer.writeheader()
+
+    def write(self, result):
+        base = {'image': result['image'], 'total_mean': result.get('total_mean'), 'error': result.get('error', '')}
+        contours = result.get('contours') or []
+        if not contours:
+            self.writer.writerow(base)
+        for i, c in enumerate(contours):
+            self.writer.writerow(dict(base, contour=i, **c))
+
+
+# JSON Lines，每張影像一列
+class JsonWriter:
+    def __init__(self, fp):
+        self.fp = fp
+
+    def write(self, result):
+        self.fp.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+
+# 每個子行程只用一條 OpenCV 執行緒，避免和行程池互相搶核心 (spawn 的子行程不會繼承主行程的設定)
+def process_pool(workers):
+    return ProcessPoolExecutor(max_workers=workers, initializer=cv2.setNumThreads, initargs=(1,))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='無介面批次執行二值化/模糊/膨脹/侵蝕與輪廓均值計算')
+    parser.add_argument('inputs', nargs='+', help='影像目錄或萬用字元，例如 images/*.png')
+    parser.add_argument('-o', '--output', default='-', help='輸出檔案，預設為標準輸出')
+    parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+    settings.add_pipeline_args(parser)
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='子行程數量')
+    parser.add_argument('--chunksize', type=int, default=8)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    paths = collect_images(args.inputs)
+    values, rois, options = settings.resolve_params(args)
+    if not settings.check_blur([values[1]]):
+        return 2
+    params = dict(zip(settings.PARAM_KEYS, values), rois=rois, **options)
+    fp = sys.stdout if args.output == '-' else open(args.output, 'w', newline='', encoding='utf-8')
+    try:
+        writer = CsvWriter(fp) if args.format == 'csv' else JsonWriter(fp)
+        with process_pool(args.workers) as pool:
+            # map 依序回傳結果，處理完就寫出，不必等全部完成
+            for result in pool.map(process_image, paths, [params] * len(paths), chunksize=args.chunksize):
+                writer.write(result)
+    finally:
+        if fp is not sys.stdout:
+            fp.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
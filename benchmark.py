@@ -0,0 +1,228 @@
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import image_pipeline
+import settings
+from batch import collect_images
+from metrics import StageTimer, peak_rss_mb
+from shared_pool import SharedFramePool
+
+RESOLUTIONS = ['640x480', '1280x720', '1920x1080', '3840x2160']
+BLUR_SIZES = [1, 5, 9, 15]  # spinBox_guass 的範圍 1~15 (奇數)
+KERNEL_SIZES = [1, 10, 25, 50]  # slider_dilate / slider_erode 的範圍 1~50
+
+
+# 產生固定亂數種子的合成影像：sparse 為少量大物件，dense 為大量小斑點
+def synthetic_frame(scene, width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    frame = (rng.random((height, width, 3)) * 40).astype(np.uint8)  # 暗色雜訊背景
+    if scene == 'sparse':
+        for _ in range(8):
+            x, y = int(rng.integers(0, width * 3 // 4)), int(rng.integers(0, height * 3 // 4))
+            w, h = int(rng.integers(width // 20, width // 4)), int(rng.integers(height // 20, height // 4))
+            color = tuple(int(c) for c in rng.integers(150, 255, 3))
+            cv2.rectangle(frame, (x, y), (x + w, y + h), color, -1)
+    else:
+        count = width * height // 400
+        xs = rng.integers(0, width, count)
+        ys = rng.integers(0, height, count)
+        radius = max(1, width // 640)
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            cv2.circle(frame, (x, y), radius, (200, 200, 200), -1)
+    return frame
+
+
+def parse_resolution(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def parse_ints(text):
+    return [int(v) for v in text.split(',') if v]
+
+
+# 對同一張影像重複執行整個流程，回傳各階段中位數與整體吞吐量
+def run_case(frame, binary, blur, dilate, erode, repeats, warmup=1, scale=1, tiles=1):
+    timer = StageTimer(enabled=True, window=repeats)
+    cache = image_pipeline.PipelineCache(timer, tiles)
+    draw_buffer = np.empty_like(frame)
+    totals = []
+    for i in range(warmup + repeats):
+        if i == warmup:
+            timer.samples.clear()
+        start = time.perf_counter()
+        # 每次給新的影像編號，強制所有階段重新計算
+        _, stats = cache.analyze(frame, i, (binary, blur, dilate, erode), scale=scale)
+        with timer.stage('draw'):
+            image_pipeline.draw_contours(frame, stats, True, draw_buffer)
+        if i >= warmup:
+            totals.append(time.perf_counter() - start)
+
+    summary = timer.summary()
+    total_ms = float(np.median(totals) * 1000)
+    return {
+        'total_ms': total_ms,
+        'fps': 1000.0 / total_ms if total_ms > 0 else 0.0,
+        'contours': int(len(stats)),
+        'stages': {name: round(s['p50'], 4) for name, s in summary['stages'].items()},
+    }
+
+
+# 穩定運作時每張影像配置的記憶體：暖機後以 tracemalloc 追蹤 (numpy 與 OpenCV 回傳的陣列都會被記錄)，
+# 回傳每張影像處理過程中的最大配置量與處理後仍未釋放的量 (KB)；緩衝區都有重複使用時兩者都接近 0
+def run_memory_case(frame, binary, blur, dilate, erode, repeats, scale=1, tiles=1):
+    cache = image_pipeline.PipelineCache(None, tiles)
+    draw_buffer = np.empty_like(frame)
+    params = (binary, blur, dilate, erode)
+    for i in range(2):  # 讓輪流使用的緩衝區都配置好
+        _, stats = cache.analyze(frame, i, params, scale=scale)
+    peaks, retained = [], []
+    tracemalloc.start()
+    try:
+        for i in range(2, 2 + repeats):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            _, stats = cache.analyze(frame, i, params, scale=scale)
+            image_pipeline.draw_contours(frame, stats, True, draw_buffer)
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(current - before)
+    finally:
+        tracemalloc.stop()
+    return {'alloc_kb': round(max(peaks) / 1024, 1), 'retained_kb': round(max(retained) / 1024, 1)}
+
+
+# 多行程處理的吞吐量：同時送出多張影像，依序取回結果
+def run_pool_case(frame, binary, blur, dilate, erode, repeats, workers, scale=1):
+    pool = SharedFramePool(workers, frame.shape)
+    try:
+        params = (binary, blur, dilate, erode)
+        count = max(repeats, pool.slots * 2)
+        submitted, done = 0, 0
+        start = time.perf_counter()
+        while done < count:
+            while submitted < count and pool.submit(frame, submitted, params, scale=scale) is not None:
+                submitted += 1
+            if pool.get(timeout=10) is not None:
+                done += 1
+        return count / (time.perf_counter() - start)
+    finally:
+        pool.close()
+
+
+def iter_cases(args):
+    blurs = parse_ints(args.blur)
+    kernels = parse_ints(args.kernel)
+    # 預設膨脹與侵蝕使用相同 kernel，--cross 時交叉組合
+    pairs = itertools.product(kernels, kernels) if args.cross else [(k, k) for k in kernels]
+    pairs = list(pairs)
+
+    frames = []
+    for res in args.resolutions.split(','):
+        width, height = parse_resolution(res)
+        for scene in args.scenes.split(','):
+            frames.append(('%s_%dx%d' % (scene, width, height), synthetic_frame(scene, width, height, args.seed)))
+    for path in collect_images(args.fixtures):
+        frame = cv2.imread(path)
+        if frame is not None:
+            height, width = frame.shape[:2]
+            frames.append(('fixture_%s_%dx%d' % (path, width, height), frame))
+
+    for name, frame in frames:
+        for scale in [float(v) for v in args.scale.split(',')]:
+            for tiles in parse_ints(args.tiles):
+                suffix = ('' if scale == 1 else '_s%g' % scale) + ('' if tiles == 1 else '_t%d' % tiles)
+                for blur in blurs:
+                    for dilate, erode in pairs:
+                        yield ('%s_b%d_d%d_e%d%s' % (name, blur, dilate, erode, suffix),
+                               frame, blur, dilate, erode, scale, tiles)
+
+
+# 和基準比較，總耗時變慢超過 threshold (比例) 的項目視為退步
+def compare(results, baseline, threshold):
+    regressions = []
+    for case, result in results.items():
+        base = baseline.get(case)
+        if base is None:
+            continue
+        ratio = result['total_ms'] / base['total_ms'] - 1 if base['total_ms'] > 0 else 0.0
+        if ratio > threshold:
+            regressions.append((case, base['total_ms'], result['total_ms'], ratio))
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='handle_image 與輪廓統計的效能測試')
+    parser.add_argument('--resolutions', default=','.join(RESOLUTIONS), help='例如 640x480,1920x1080')
+    parser.add_argument('--scenes', default='sparse,dense', help='合成影像種類 sparse,dense')
+    parser.add_argument('--fixtures', nargs='*', default=[], help='額外加入測試的影像目錄或萬用字元')
+    parser.add_argument('--blur', default=','.join(map(str, BLUR_SIZES)), help='高斯模糊 kernel 清單 (奇數)')
+    parser.add_argument('--kernel', default=','.join(map(str, KERNEL_SIZES)), help='膨脹/侵蝕 kernel 清單')
+    parser.add_argument('--cross', action='store_true', help='膨脹與侵蝕 kernel 交叉組合')
+    parser.add_argument('--scale', default='1', help='縮小處理的倍率清單，例如 1,0.5,0.25')
+    parser.add_argument('--tiles', default='1', help='水平條帶平行處理的條數清單，例如 1,2,4')
+    parser.add_argument('--binary', type=int, default=128)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threads', type=int, default=-1, help='cv2.setNumThreads，-1 為 OpenCV 預設')
+    parser.add_argument('--pool', default='', help='另外測試多行程處理的吞吐量，子行程數量清單，例如 1,2,4')
+    parser.add_argument('--memory', action='store_true', help='另外量測穩定運作時每張影像配置的記憶體')
+    parser.add_argument('--save', help='把結果存成基準 JSON')
+    parser.add_argument('--compare', help='和基準 JSON 比較')
+    parser.add_argument('--threshold', type=float, default=0.15, help='總耗時增加超過此比例視為退步')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not settings.check_blur(parse_ints(args.blur)):
+        return 2
+    if args.threads >= 0:
+        cv2.setNumThreads(args.threads)
+
+    results = {}
+    print('%-48s %10s %8s %9s  %s' % ('case', 'total ms', 'fps', 'contours', 'stages (p50 ms)'))
+    for case, frame, blur, dilate, erode, scale, tiles in iter_cases(args):
+        result = run_case(frame, args.binary, blur, dilate, erode, args.repeats, scale=scale, tiles=tiles)
+        results[case] = result
+        stages = ' '.join('%s=%.2f' % item for item in result['stages'].items())
+        print('%-48s %10.2f %8.1f %9d  %s' % (case, result['total_ms'], result['fps'], result['contours'], stages))
+        if args.pool:
+            result['pool_fps'] = {str(n): run_pool_case(frame, args.binary, blur, dilate, erode, args.repeats, n,
+                                                        scale) for n in parse_ints(args.pool)}
+            print('%-48s %s' % ('', ' '.join('pool%s=%.1f fps' % item for item in result['pool_fps'].items())))
+        if args.memory:
+            result['memory'] = run_memory_case(frame, args.binary, blur, dilate, erode, args.repeats, scale, tiles)
+            print('%-48s alloc %.1f KB/frame  retained %.1f KB' % ('', result['memory']['alloc_kb'],
+                                                                  result['memory']['retained_kb']))
+        sys.stdout.flush()
+
+    print('peak RSS %s MB' % peak_rss_mb())
+    if args.save:
+        meta = {'opencv': cv2.__version__, 'numpy': np.__version__, 'machine': platform.platform(),
+                'time': time.time(), 'repeats': args.repeats, 'peak_rss_mb': peak_rss_mb()}
+        with open(args.save, 'w', encoding='utf-8') as fp:
+            json.dump({'meta': meta, 'results': results}, fp, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as fp:
+            baseline = json.load(fp)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for case, before, after, ratio in regressions:
+            print('REGRESSION %s: %.2f ms -> %.2f ms (+%.0f%%)' % (case, before, after, ratio * 100))
+        if regressions:
+            return 1
+        print('no regressions beyond %.0f%%' % (args.threshold * 100))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
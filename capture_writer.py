@@ -0,0 +1,108 @@
+import datetime
+import io
+import itertools
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+FORMATS = ('png', 'jpg', 'npy')
+
+
+# 背景存檔：有上限的佇列加上多條編碼/寫檔執行緒，介面只負責把影像放進佇列
+class CaptureWriter:
+    def __init__(self, workers=2, max_queue=32, png_compression=3, jpeg_quality=95):
+        self.png_compression = png_compression
+        self.jpeg_quality = jpeg_quality
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.sequence = itertools.count()
+        # 統計
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0  # 佇列滿了沒能存的張數
+        self.failed = 0
+        self.bytes_written = 0
+        self.write_seconds = 0.0
+
+        self.workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    # 產生不會重複的檔名：日期_時間(毫秒)_序號
+    def unique_name(self, ext):
+        date_time = datetime.datetime.now()
+        with self.lock:
+            seq = next(self.sequence)
+        return '%s_%s_%06d.%s' % (date_time.strftime('%Y%m%d'), date_time.strftime('%H%M%S%f')[:-3], seq, ext)
+
+    # 放入一張要儲存的影像，佇列滿時不等待，直接回傳 None 並計入 dropped
+    def submit(self, frame, directory, fmt='png', copy=True):
+        if fmt not in FORMATS:
+            raise ValueError('unknown format: %s' % fmt)
+        path = os.path.join(directory, self.unique_name(fmt))
+        try:
+            self.queue.put_nowait((np.array(frame, copy=True) if copy else frame, path, fmt))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return None
+        with self.lock:
+            self.submitted += 1
+        return path
+
+    def encode(self, frame, fmt):
+        if fmt == 'npy':
+            buffer = io.BytesIO()
+            np.save(buffer, frame)
+            return buffer.getvalue()
+        if fmt == 'jpg':
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+        else:
+            params = [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+        ret, data = cv2.imencode('.' + fmt, frame, params)
+        if not ret:
+            raise ValueError('encode failed')
+        return data.tobytes()
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            frame, path, fmt = item
+            start = time.perf_counter()
+            try:
+                data = self.encode(frame, fmt)
+                # 'xb' 確保不會覆蓋既有的檔案
+                with open(path, 'xb') as fp:
+                    fp.write(data)
+            except (OSError, ValueError, cv2.error) as exc:
+                print(exc)
+                with self.lock:
+                    self.failed += 1
+            else:
+                with self.lock:
+                    self.written += 1
+                    self.bytes_written += len(data)
+                    self.write_seconds += time.perf_counter() - start
+            finally:
+                self.queue.task_done()
+
+    def stats(self):
+        with self.lock:
+            avg_ms = self.write_seconds / self.written * 1000 if self.written else 0.0
+            return {'submitted': self.submitted, 'written': self.written, 'dropped': self.dropped,
+                    'failed': self.failed, 'backlog': self.queue.qsize(), 'capacity': self.queue.maxsize,
+                    'bytes': self.bytes_written, 'avg_write_ms': avg_ms}
+
+    # 結束前等佇列中的影像全部寫完
+    def close(self, wait=True):
+        if wait:
+            self.queue.join()
+        for _ in self.workers:
+            self.queue.put(None)
@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import image_pipeline
+import settings
+
+INDEX_DTYPE = np.dtype([('timestamp', np.float64)])
+
+
+# 影像封存檔：固定大小的原始影像依序寫入 path，另有 .idx (每張的時間戳) 與 .json (影像大小) 兩個附檔
+def archive_paths(path):
+    return path, path + '.idx', path + '.json'
+
+
+# 寫入封存檔：每張影像直接寫入原始位元組，不做任何編碼
+class FrameArchiveWriter:
+    def __init__(self, path, shape, dtype=np.uint8):
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        data_path, index_path, meta_path = archive_paths(path)
+        with open(meta_path, 'w', encoding='utf-8') as fp:
+            json.dump({'shape': list(self.shape), 'dtype': self.dtype.str}, fp)
+        self.data_fp = open(data_path, 'wb')
+        self.index_fp = open(index_path, 'wb')
+        self.count = 0
+
+    def append(self, frame, timestamp=None):
+        if frame.shape != self.shape or frame.dtype != self.dtype:
+            raise ValueError('frame shape %s does not match archive shape %s' % (frame.shape, self.shape))
+        self.data_fp.write(np.ascontiguousarray(frame).data)
+        self.index_fp.write(np.array([(time.time() if timestamp is None else timestamp,)], INDEX_DTYPE).tobytes())
+        self.count += 1
+
+    def close(self):
+        self.data_fp.close()
+        self.index_fp.close()
+
+
+# 讀取封存檔：以記憶體映射開啟，archive[i] 直接回傳映射區的唯讀 numpy view，不複製也不解碼
+class FrameArchive:
+    def __init__(self, path):
+        self.path = path
+        data_path, index_path, meta_path = archive_paths(path)
+        with open(meta_path, encoding='utf-8') as fp:
+            meta = json.load(fp)
+        self.shape = tuple(meta['shape'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.timestamps = np.fromfile(index_path, INDEX_DTYPE)['timestamp']
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        # 以兩個檔案中較少的張數為準 (錄影中斷時最後一張可能不完整)
+        count = min(len(self.timestamps), os.path.getsize(data_path) // frame_bytes)
+        self.timestamps = self.timestamps[:count]
+        self.frames = np.memmap(data_path, self.dtype, 'r', shape=(count,) + self.shape) if count else \
+            np.zeros((0,) + self.shape, self.dtype)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def duration(self):
+        return float(self.timestamps[-1] - self.timestamps[0]) if len(self) > 1 else 0.0
+
+
+# 從任一影像來源錄製封存檔
+def record(source, path, seconds=None, frames=None):
+    writer = None
+    count = 0
+    start = time.time()
+    try:
+        while source.isOpened():
+            ret, frame = source.read()
+            if not ret:
+                break
+            if writer is None:
+                writer = FrameArchiveWriter(path, frame.shape, frame.dtype)
+            writer.append(frame)
+            count += 1
+            if (frames is not None and count >= frames) or (seconds is not None and time.time() - start >= seconds):
+                break
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+# 以最快速度重播封存檔並執行處理流程，回傳每秒處理張數
+def replay(path, params, scale=1, limit=None, full_res_mean=True):
+    archive = FrameArchive(path)
+    cache = image_pipeline.PipelineCache()
+    count = len(archive) if limit is None else min(limit, len(archive))
+    start = time.perf_counter()
+    for i in range(count):
+        cache.analyze(archive[i], i, params, True, scale, full_res_mean)
+    elapsed = time.perf_counter() - start
+    return count / elapsed if elapsed > 0 else 0.0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='原始影像封存檔的錄製、資訊與重播測試')
+    commands = parser.add_subparsers(dest='command', required=True)
+    rec = commands.add_parser('record', help='從影像來源錄製封存檔')
+    rec.add_argument('source', help='影像來源，例如 0、file:a.mp4')
+    rec.add_argument('output')
+    rec.add_argument('--seconds', type=float)
+    rec.add_argument('--frames', type=int)
+    rec.add_argument('--width', type=int, default=1920)
+    rec.add_argument('--height', type=int, default=1080)
+    info = commands.add_parser('info', help='顯示封存檔的張數、大小與時間長度')
+    info.add_argument('archive')
+    play = commands.add_parser('replay', help='以最快速度重播並執行處理流程')
+    play.add_argument('archive')
+    settings.add_pipeline_args(play)
+    play.add_argument('--limit', type=int)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'record':
+        from sources import create_source  # sources 也會載入本模組，在這裡才載入避免循環
+        source = create_source(args.source, args.width, args.height)
+        if not source.open():
+            print('無法開啟影像來源: %s' % args.source, file=sys.stderr)
+            return 1
+        try:
+            count = record(source, args.output, args.seconds, args.frames)
+        finally:
+            source.release()
+        print('%d frames -> %s' % (count, args.output))
+    elif args.command == 'info':
+        archive = FrameArchive(args.archive)
+        print('frames %d  shape %s  dtype %s  duration %.2f s' % (len(archive), archive.shape, archive.dtype,
+                                                                  archive.duration()))
+    else:
+        params, _, options = settings.resolve_params(args)  # 重播只量測處理速度，不使用 ROI
+        if not settings.check_blur([params[1]]):
+            return 2
+        fps = replay(args.archive, params, options['scale'], args.limit, options['full_res_mean'])
+        print('%.1f fps' % fps)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+import collections
+import threading
+import time
+
+
+# 固定容量的最新影像環形緩衝區，滿了就丟棄最舊的影像
+class FrameRingBuffer:
+    def __init__(self, capacity=2, listener=None):
+        self.capacity = capacity
+        self.listener = listener  # 放入影像後呼叫，例如通知 Scheduler
+        self.frames = collections.deque(maxlen=capacity)
+        self.condition = threading.Condition()
+        self.seq = 0  # 最新影像的序號
+        # 統計計數
+        self.captured = 0
+        self.processed = 0
+        self.dropped = 0
+
+    # 放入一張影像，緩衝區已滿時最舊的影像會被擠掉
+    def put(self, frame):
+        with self.condition:
+            if len(self.frames) == self.capacity:
+                self.dropped += 1
+            self.seq += 1
+            self.captured += 1
+            self.frames.append((self.seq, time.perf_counter(), frame))
+            self.condition.notify_all()
+        if self.listener is not None:
+            self.listener()
+
+    # 取出最新的影像，其餘尚未處理的舊影像一併視為丟棄
+    def get_latest(self, timeout=None):
+        with self.condition:
+            if not self.frames:
+                self.condition.wait(timeout)
+            if not self.frames:
+                return None
+            item = self.frames.pop()
+            self.dropped += len(self.frames)
+            self.frames.clear()
+            self.processed += 1
+            return item
+
+    def clear(self):
+        with self.condition:
+            self.frames.clear()
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {'captured': self.captured, 'processed': self.processed, 'dropped': self.dropped}
+
+
+# 抓取執行緒：持續從相機讀取影像放入環形緩衝區，和影像處理分開執行；
+# 每張抓到的影像 (包含處理跟不上而被緩衝區丟棄的) 都以抓取時間交給錄影器
+class CaptureThread(threading.Thread):
+    def __init__(self, cap, buffer, timer=None, recorder=None):
+        super(CaptureThread, self).__init__(daemon=True)
+        self.cap = cap
+        self.buffer = buffer
+        self.timer = timer  # metrics.StageTimer，記錄讀取耗時
+        self.recorder = recorder  # recorder.PreTriggerRecorder
+        self.running = True
+
+    def run(self):
+        while self.running and self.cap.isOpened():
+            if self.timer is None:
+                ret, frame = self.cap.read()
+            else:
+                with self.timer.stage('read'):
+                    ret, frame = self.cap.read()
+                self.timer.tick('capture')
+            if ret:
+                if self.recorder is not None:
+                    self.recorder.push(frame, time.time())
+                self.buffer.put(frame)
+            else:
+                time.sleep(0.001)
+        # 通知等待中的處理端不用再等
+        self.buffer.clear()
+
+    def stop(self):
+        self.running = False
+
+
+# 只保留一張待顯示影像的信箱：新影像會直接取代尚未被介面取走的舊影像
+class FrameMailbox:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.item = None
+        self.delivered = 0
+        self.replaced = 0  # 還沒顯示就被新影像取代的張數
+
+    # 放入影像，回傳信箱原本是否為空 (為空時才需要通知介面)
+    def post(self, item):
+        with self.lock:
+            was_empty = self.item is None
+            if not was_empty:
+                self.replaced += 1
+            self.item = item
+            return was_empty
+
+    def take(self):
+        with self.lock:
+            item, self.item = self.item, None
+            if item is not None:
+                self.delivered += 1
+            return item
+
+
+# 處理執行緒的排程：新影像、參數變更、載入圖片、停止等事件都會喚醒等待中的處理端，
+# 沒有事件時完全阻塞；同時記錄每個事件從通知到被處理端取走的延遲
+class Scheduler:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = {}  # 事件名稱 -> 第一次通知的時間 (perf_counter)
+
+    def notify(self, event):
+        with self.condition:
+            self.pending.setdefault(event, time.perf_counter())
+            self.condition.notify_all()
+
+    # 等到有事件為止，回傳 {事件名稱: 等待延遲 (秒)} 並清空；逾時回傳空 dict
+    def wait(self, timeout=None):
+        with self.condition:
+            if not self.pending:
+                self.condition.wait(timeout)
+            now = time.perf_counter()
+            events = {event: now - posted for event, posted in self.pending.items()}
+            self.pending.clear()
+            return events
@@ -0,0 +1,381 @@
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+# 膨脹/侵蝕的 kernel，每個大小只建立一次；設成唯讀，讓各執行緒共用
+@functools.lru_cache(maxsize=None)
+def morph_kernel(size):
+    kernel = np.ones((size, size), np.uint8)
+    kernel.flags.writeable = False
+    return kernel
+
+
+# 預先配置的輸出緩衝區：同一個名稱輪流使用 count 個緩衝區，以 dst 參數交給 OpenCV 直接寫入，
+# 大小或型別改變時才重新配置；輪流使用讓前 count - 1 次的結果在被覆寫前仍可使用
+class BufferPool:
+    def __init__(self, count=2):
+        self.count = count
+        self.buffers = {}  # 名稱 -> [緩衝區清單, 下一個使用的位置]
+        self.allocations = 0  # 累計配置次數與位元組數，穩定運作時不再增加
+        self.allocated_bytes = 0
+
+    def get(self, name, shape, dtype=np.uint8):
+        shape, dtype = tuple(shape), np.dtype(dtype)
+        entry = self.buffers.get(name)
+        if entry is None or entry[0][0].shape != shape or entry[0][0].dtype != dtype:
+            entry = self.buffers[name] = [[], 0]
+        arrays, index = entry
+        if index == len(arrays):
+            arrays.append(np.empty(shape, dtype))
+            self.allocations += 1
+            self.allocated_bytes += arrays[-1].nbytes
+        entry[1] = (index + 1) % self.count
+        return arrays[index]
+
+
+# 縮小處理：scale 為 1/2、1/4、1/8 等縮小倍率，以金字塔方式每次縮小一半 (INTER_AREA 的 2 倍縮小最快)
+# buffers (BufferPool) 不為 None 時，每一層都寫入預先配置的緩衝區
+def downscale(frame, scale, buffers=None):
+    level = 0
+    while scale <= 0.5 or scale != 1:
+        if scale <= 0.5:
+            size = (max(1, frame.shape[1] // 2), max(1, frame.shape[0] // 2))
+            scale *= 2
+        else:
+            size = (max(1, int(round(frame.shape[1] * scale))), max(1, int(round(frame.shape[0] * scale))))
+            scale = 1
+        dst = None if buffers is None else buffers.get('scale %d' % level, (size[1], size[0]) + frame.shape[2:],
+                                                        frame.dtype)
+        frame = cv2.resize(frame, size, dst=dst, interpolation=cv2.INTER_AREA)
+        level += 1
+    return frame
+
+
+# 依縮小倍率等比例縮小模糊與膨脹/侵蝕 kernel，二值化門檻不變；模糊 kernel 維持奇數
+def scale_params(binary_value, blur_value, dilate_value, erode_value, scale):
+    if scale == 1:
+        return binary_value, blur_value, dilate_value, erode_value
+    blur_value = max(1, int(round(blur_value * scale)))
+    if blur_value % 2 == 0:
+        blur_value += 1
+    dilate_value = max(1, int(round(dilate_value * scale))) if dilate_value > 0 else dilate_value
+    erode_value = max(1, int(round(erode_value * scale))) if erode_value > 0 else erode_value
+    return binary_value, blur_value, dilate_value, erode_value
+
+
+# 把縮小影像上的外框換算回全解析度座標 (向外取整，確保涵蓋原本的範圍)
+def upscale_stats(stats, small_shape, full_shape):
+    stats = stats.copy()
+    height, width = full_shape[:2]
+    ratio_y, ratio_x = height / small_shape[0], width / small_shape[1]
+    x1 = np.floor(stats['x'] * ratio_x).astype(np.int32)
+    y1 = np.floor(stats['y'] * ratio_y).astype(np.int32)
+    x2 = np.minimum(width, np.ceil((stats['x'] + stats['w']) * ratio_x)).astype(np.int32)
+    y2 = np.minimum(height, np.ceil((stats['y'] + stats['h']) * ratio_y)).astype(np.int32)
+    stats['x'], stats['y'], stats['w'], stats['h'] = x1, y1, x2 - x1, y2 - y1
+    stats['area'] *= ratio_x * ratio_y
+    return stats
+
+
+# 不使用快取的完整流程 (批次處理等無介面用途)：回傳處理後的影像 (縮小倍率下為縮小尺寸) 與全解析度座標的統計
+# full_res_mean 時均值在全解析度影像上計算，否則使用縮小影像的均值
+def analyze(frame, params, scale=1, with_mean=True, full_res_mean=True):
+    return PipelineCache().analyze(frame, 0, params, with_mean, scale, full_res_mean)
+
+
+# 把單一階段切成 tiles 條水平條帶，以執行緒池平行處理 (OpenCV 執行時會釋放 GIL)；
+# 每條上下多取 halo 列 (不小於 kernel 的影響範圍)，只保留中間的部分，因此結果和整張處理完全相同
+# func(src, dst) 的 dst 為 None 時自行配置；有 dst 時結果寫入 dst，halo 為 0 的階段每條直接寫進 dst 的對應列
+# scratch(i, rows) 回傳第 i 條含 halo 的暫存緩衝區 (rows 列)，None 時每條每次另外配置
+def run_tiled(func, src, tiles, halo, executor, dst=None, scratch=None):
+    height = src.shape[0]
+    if tiles <= 1 or executor is None or height < tiles * max(2 * halo, 16):
+        return func(src, dst)
+    bounds = np.linspace(0, height, tiles + 1).astype(int)
+    spans = [(y0, y1, max(0, y0 - halo), min(height, y1 + halo)) for y0, y1 in zip(bounds[:-1], bounds[1:])]
+    # 暫存緩衝區在這個執行緒先取好，工作執行緒不碰 BufferPool
+    strips = [None] * tiles
+    if scratch is not None and halo > 0:
+        strips = [scratch(i, bottom - top) for i, (_, _, top, bottom) in enumerate(spans)]
+
+    def work(i):
+        y0, y1, top, bottom = spans[i]
+        if dst is not None and halo == 0:
+            return func(src[y0:y1], dst[y0:y1])
+        part = func(src[top:bottom], strips[i])[y0 - top:y1 - top]
+        if dst is not None:
+            dst[y0:y1] = part
+        return part
+
+    parts = list(executor.map(work, range(tiles)))
+    return dst if dst is not None else np.concatenate(parts)
+
+
+# 逐階段快取：每個中間結果以「影像編號 + 上游參數」為 key，參數沒變的階段直接沿用
+# tiles 大於 1 時，模糊/膨脹/侵蝕等階段切成水平條帶平行處理
+# 各階段的結果寫入輪流使用的 buffers 個緩衝區，結果被保留 (例如等待顯示) 的時間不可超過 buffers - 1 次重算
+class PipelineCache:
+    STAGES = ('scale', 'gray', 'binary', 'blur', 'dilate', 'erode', 'stats')
+
+    def __init__(self, timer=None, tiles=1, buffers=2):
+        self.entries = {}  # stage -> (key, result)
+        self.hits = 0
+        self.misses = 0
+        self.timer = timer  # metrics.StageTimer，記錄各階段耗時
+        self.tiles = tiles
+        self.executor = ThreadPoolExecutor(tiles) if tiles > 1 else None
+        self.buffers = BufferPool(buffers)
+        self.scratch = BufferPool(1)  # 只在單一階段內使用的暫存 (例如積分圖)
+
+    # 只在快取沒命中時呼叫，才取用下一個緩衝區；各階段的輸出都是和 src 同大小的單通道影像
+    def _tiled(self, stage, func, src, halo=0):
+        dst = self.buffers.get(stage, src.shape[:2])
+        return run_tiled(func, src, self.tiles, halo, self.executor, dst,
+                         lambda i, rows: self.scratch.get('%s tile%d' % (stage, i), (rows, src.shape[1])))
+
+    def _stage(self, stage, key, func):
+        entry = self.entries.get(stage)
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        if self.timer is None:
+            result = func()
+        else:
+            with self.timer.stage(stage):
+                result = func()
+        self.entries[stage] = (key, result)
+        return result
+
+    # 影像處理：二值化 -> 高斯模糊 -> 膨脹 -> 侵蝕，回傳二值化影像與處理後的影像
+    # scale 小於 1 時先縮小影像，kernel 也等比例縮小
+    def handle_image(self, frame, frame_id, binary_value, blur_value, dilate_value, erode_value, scale=1):
+        key = (frame_id, scale)
+        if scale != 1:
+            frame = self._stage('scale', key, lambda: downscale(frame, scale, self.buffers))
+            binary_value, blur_value, dilate_value, erode_value = scale_params(
+                binary_value, blur_value, dilate_value, erode_value, scale)
+        gray = self._stage('gray', key, lambda: self._tiled(
+            'gray', lambda src, dst: cv2.cvtColor(src, cv2.COLOR_BGR2GRAY, dst=dst), frame))
+        key += (binary_value,)
+        binary_frame = self._stage('binary', key, lambda: self._tiled(
+            'binary', lambda src, dst: cv2.threshold(src, binary_value, 255, cv2.THRESH_BINARY, dst=dst)[1], gray))
+        key += (blur_value,)
+        img_blur = self._stage('blur', key, lambda: self._tiled(
+            'blur', lambda src, dst: cv2.GaussianBlur(src, (blur_value, blur_value), 10, dst=dst), binary_frame,
+            blur_value // 2))
+        key += (dilate_value,)
+        # kernel 為 0 時 OpenCV 改用 3x3，halo 至少取 3
+        kernel_dilate = morph_kernel(dilate_value)
+        img_dilate = self._stage('dilate', key, lambda: self._tiled(
+            'dilate', lambda src, dst: cv2.dilate(src, kernel_dilate, dst=dst, iterations=1), img_blur,
+            max(dilate_value, 3)))
+        key += (erode_value,)
+        kernel_erode = morph_kernel(erode_value)
+        img_erode = self._stage('erode', key, lambda: self._tiled(
+            'erode', lambda src, dst: cv2.erode(src, kernel_erode, dst=dst, iterations=1), img_dilate,
+            max(erode_value, 3)))
+        return binary_frame, img_erode
+
+    # 輪廓統計只依賴侵蝕後的結果，同樣以完整參數當 key；座標一律換算回全解析度
+    def contour_stats(self, frame, frame_id, params, img_process, with_mean=True, scale=1, full_res_mean=True):
+        key = (frame_id, scale) + tuple(params) + (with_mean, full_res_mean)
+
+        def compute():
+            if scale == 1:
+                return contour_stats(frame, img_process, with_mean, self.scratch)
+            small = self.entries['scale'][1]
+            stats = contour_stats(small, img_process, with_mean and not full_res_mean, self.scratch)
+            stats = upscale_stats(stats, small.shape, frame.shape)
+            if with_mean and full_res_mean and len(stats):
+                stats['mean'] = box_means(frame, stats, self.scratch)
+            return stats
+
+        return self._stage('stats', key, compute)
+
+    # 處理加上輪廓統計，回傳處理後的影像與統計
+    def analyze(self, frame, frame_id, params, with_mean=True, scale=1, full_res_mean=True):
+        _, img_process = self.handle_image(frame, frame_id, *params, scale=scale)
+        stats = self.contour_stats(frame, frame_id, params, img_process, with_mean, scale, full_res_mean)
+        return img_process, stats
+
+    def clear(self):
+        self.entries.clear()
+
+
+# 每個輪廓的統計結果：外框、輪廓面積與框內 RGB 均值
+REGION_DTYPE = np.dtype([('x', np.int32), ('y', np.int32), ('w', np.int32), ('h', np.int32),
+                         ('area', np.float64), ('mean', np.float64)])
+
+
+# 找外輪廓後把所有輪廓點串成一個陣列，以 reduceat 一次算出每個輪廓的外框與面積，
+# 不逐一呼叫 boundingRect；with_mean 為 False 時均值填 0
+def contour_stats(frame, img_process, with_mean=True, buffers=None):
+    contours, _ = cv2.findContours(img_process, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    stats = np.zeros(len(contours), dtype=REGION_DTYPE)
+    if len(contours) == 0:
+        return stats
+
+    lengths = np.fromiter(map(len, contours), np.intp, len(contours))
+    starts = np.zeros(len(contours), np.intp)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    points = np.concatenate(contours).reshape(-1, 2)
+
+    # 外框 (和 cv2.boundingRect 相同)
+    low = np.minimum.reduceat(points, starts)
+    high = np.maximum.reduceat(points, starts)
+    stats['x'], stats['y'] = low[:, 0], low[:, 1]
+    stats['w'], stats['h'] = high[:, 0] - low[:, 0] + 1, high[:, 1] - low[:, 1] + 1
+
+    # 鞋帶公式算面積 (和 cv2.contourArea 相同)
+    x = points[:, 0].astype(np.int64)
+    y = points[:, 1].astype(np.int64)
+    following = np.arange(1, len(points) + 1)
+    following[starts + lengths - 1] = starts  # 每個輪廓最後一點接回第一點
+    stats['area'] = np.abs(np.add.reduceat(x * y[following] - x[following] * y, starts)) / 2
+
+    if with_mean:
+        stats['mean'] = box_means(frame, stats, buffers)
+    return stats
+
+
+# 以積分圖一次算出所有外框內的均值 (和對裁切影像取 mean() 相同)，只對涵蓋所有外框的範圍做積分
+# buffers 不為 None 時，積分圖寫入整張影像大小的一維緩衝區前段 (範圍每張不同，大小不固定)
+def box_means(frame, stats, buffers=None):
+    left, top = int(stats['x'].min()), int(stats['y'].min())
+    right, bottom = int((stats['x'] + stats['w']).max()), int((stats['y'] + stats['h']).max())
+    region = frame[top:bottom, left:right]
+    # 總和不會超過 int32 時用整數積分圖，比 float64 快一倍
+    depth = cv2.CV_32S if region.size * 255 < 2 ** 31 else cv2.CV_64F
+    integral = None
+    if buffers is not None:
+        dtype = np.int32 if depth == cv2.CV_32S else np.float64
+        shape = (bottom - top + 1, right - left + 1) + frame.shape[2:]
+        # 兩種深度各用一個緩衝區，外框範圍大小交替時不必重新配置
+        flat = buffers.get('integral%d' % (dtype().itemsize * 8),
+                           ((frame.shape[0] + 1) * (frame.shape[1] + 1) * region[0, 0].size,), dtype)
+        integral = flat[:int(np.prod(shape))].reshape(shape)
+    return integral_means(cv2.integral(region, sum=integral, sdepth=depth), stats, left, top)
+
+
+# 從已經算好的積分圖取出各外框內的均值，積分圖的原點在 (left, top)
+def integral_means(integral, stats, left=0, top=0):
+    if integral.ndim == 2:
+        integral = integral[:, :, np.newaxis]
+    x1, y1 = stats['x'] - left, stats['y'] - top
+    x2, y2 = x1 + stats['w'], y1 + stats['h']
+    sums = (integral[y2, x2].astype(np.float64) - integral[y1, x2] - integral[y2, x1] + integral[y1, x1])
+    return sums.sum(axis=1) / (stats['w'] * stats['h'] * integral.shape[2])
+
+
+# 把 ROI (x, y, w, h) 限制在影像範圍內，完全在影像外時回傳 None
+def clip_roi(roi, shape):
+    height, width = shape[:2]
+    x, y, w, h = roi
+    x1, y1 = max(0, x), max(0, y)
+    x2, y2 = min(width, x + w), min(height, y + h)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return x1, y1, x2 - x1, y2 - y1
+
+
+# 只在各個 ROI 內執行處理流程，輪廓座標換算回整張影像
+# caches 為 roi -> PipelineCache，回傳整張大小的處理結果 (ROI 外為 0) 與每個 ROI 的統計；
+# out 為重複使用的整張大小單通道緩衝區，None 時另外配置
+def process_rois(frame, frame_id, params, rois, caches, with_mean=True, timer=None, scale=1, full_res_mean=True,
+                 out=None):
+    if out is None:
+        img_process = np.zeros(frame.shape[:2], np.uint8)
+    else:
+        img_process = out
+        img_process.fill(0)
+    results = []
+    for roi in rois:
+        clipped = clip_roi(roi, frame.shape)
+        if clipped is None:
+            results.append(np.zeros(0, dtype=REGION_DTYPE))
+            continue
+        x, y, w, h = clipped
+        crop = frame[y:y + h, x:x + w]
+        cache = caches.get(roi)
+        if cache is None:
+            cache = caches[roi] = PipelineCache(timer)
+        roi_process, stats = cache.analyze(crop, frame_id, params, with_mean, scale, full_res_mean)
+        if scale != 1:
+            roi_process = cv2.resize(roi_process, (w, h), interpolation=cv2.INTER_NEAREST)
+        img_process[y:y + h, x:x + w] = roi_process
+
+        stats = stats.copy()
+        stats['x'] += x
+        stats['y'] += y
+        results.append(stats)
+    return img_process, results
+
+
+# 畫出 ROI 的範圍
+def draw_rois(img, rois):
+    for x, y, w, h in rois:
+        cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 2)
+    return img
+
+
+# 畫面變化偵測：把影像縮成灰階小圖，和上一張處理過的影像逐格比較，
+# 任一格的灰階差超過 threshold 才算有變化；threshold 為 0 時每張都視為有變化
+class ChangeDetector:
+    def __init__(self, threshold=8, size=(64, 36)):
+        self.threshold = threshold
+        self.size = size
+        self.reference = None  # 上一張處理過的影像的小圖
+        self.checked = 0
+        self.skipped = 0
+
+    def changed(self, frame):
+        if self.threshold <= 0:
+            return True
+        self.checked += 1
+        # 先間隔取樣再縮小，避免整張影像做 cvtColor 與 resize
+        step = max(1, min(frame.shape[0] // self.size[1], frame.shape[1] // self.size[0]) // 4)
+        sample = frame[::step, ::step]
+        if sample.ndim == 3:
+            sample = cv2.cvtColor(sample, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(sample, self.size, interpolation=cv2.INTER_AREA)
+        if self.reference is None or cv2.absdiff(small, self.reference).max() > self.threshold:
+            self.reference = small
+            return True
+        self.skipped += 1
+        return False
+
+
+# 所有輪廓的總均值，沒有輪廓時回傳 None
+def total_mean(stats):
+    if len(stats) == 0:
+        return None
+    return float(stats['mean'].mean())
+
+
+# 在原圖的複本上畫出輪廓外框，show_text 時一併標示均值；out 為重複使用的同大小緩衝區，None 時另外配置
+def draw_contours(frame, stats, show_text=False, out=None):
+    if out is None:
+        img_draw = frame.copy()
+    else:
+        img_draw = out
+        np.copyto(img_draw, frame)
+    if len(stats) == 0:
+        return img_draw
+
+    # 所有外框一次交給 polylines 畫完
+    x1, y1 = stats['x'], stats['y']
+    x2, y2 = x1 + stats['w'], y1 + stats['h']
+    boxes = np.stack([np.stack([x1, y1], 1), np.stack([x2, y1], 1),
+                      np.stack([x2, y2], 1), np.stack([x1, y2], 1)], 1).astype(np.int32)
+    cv2.polylines(img_draw, list(boxes), True, (255, 0, 0), 3)
+
+    if show_text:
+        centers_x = x1 + stats['w'] // 2
+        centers_y = y1 + stats['h'] // 2
+        for cx, cy, mean in zip(centers_x.tolist(), centers_y.tolist(), stats['mean'].tolist()):
+            cv2.putText(img_draw, str(int(mean)), (cx, cy), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+    return img_draw
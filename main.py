@@ -1,36 +1,91 @@
-import datetime
 import os
 import re
 import sys
 import threading
 import time
 
+START_TIME = time.perf_counter()  # 量測啟動時間的起點，放在載入 OpenCV / PyQt 之前
+
 import cv2
 import numpy as np
-from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot, Qt
-from PyQt5.QtGui import QImage, QPixmap
-from PyQt5.QtWidgets import QFileDialog, QMainWindow, QGraphicsScene, QApplication, QMessageBox
+from PyQt5.QtCore import QEvent, QObject, QThread, QTimer, pyqtSignal, pyqtSlot, Qt
+from PyQt5.QtGui import QImage, QPixmap, QPen, QColor
+from PyQt5.QtWidgets import QFileDialog, QMainWindow, QGraphicsScene, QApplication, QMessageBox, \
+    QGraphicsPixmapItem, QLabel, QGraphicsRectItem, QPushButton, QComboBox, QCheckBox, QSpinBox, \
+    QGraphicsView, QHBoxLayout, QSlider
 
 import camera_ui
+import image_pipeline
+import settings
+from capture_writer import CaptureWriter
+from measurement_log import MeasurementLog
+from recorder import PreTriggerRecorder
+from frame_buffer import CaptureThread, FrameMailbox, FrameRingBuffer, Scheduler
+from metrics import MetricsDumper, StageTimer, peak_rss_mb
+from shared_pool import SharedFramePool
+from sources import ArchiveSource, CameraSource, create_source, probe_cameras
 
 WIDTH = 1920
 HEIGHT = 1080
 COM = 0
-
-VIDEO = cv2.VideoCapture(COM, cv2.CAP_DSHOW)
+BUFFER_SIZE = 2  # 抓取緩衝區可存放的影像張數
+DISPLAY_FPS = 15  # 畫面更新的最高頻率，0 代表不限制，與處理速度無關
+# 各階段耗時統計，關閉時幾乎沒有額外負擔
+METRICS_ENABLED = False
+METRICS_OVERLAY = True  # 統計開啟時，在左側畫面上疊加顯示統計數字
+METRICS_DUMP_PATH = ''  # 定期輸出統計的檔案 (.csv 或 .jsonl)，空字串代表不輸出
+METRICS_DUMP_INTERVAL = 10  # 秒
+SETTINGS_PATH = 'settings.json'  # 啟動時自動載入的參數與 ROI 設定檔
+# 背景存檔設定
+WRITER_WORKERS = 2  # 編碼/寫檔的執行緒數量
+WRITER_QUEUE = 32  # 等待寫入的影像上限，超過時丟棄並提示
+PNG_COMPRESSION = 3  # 0~9，越大檔案越小但越慢
+JPEG_QUALITY = 95  # 0~100
+# 觸發錄影：輪廓出現時，把之前 RECORD_PRE_SECONDS 秒與之後 RECORD_POST_SECONDS 秒的影像存成影片
+RECORD_ENABLED = False
+RECORD_DIR = 'recordings'
+RECORD_PRE_SECONDS = 5
+RECORD_POST_SECONDS = 5
+RECORD_MAX_MB = 200  # 觸發前影像在記憶體中的上限
+RECORD_SEGMENT_SECONDS = 60  # 每個影片檔的長度
+RECORD_FPS = 24  # 來源取不到實際速率時影片使用的 fps
+# 量測紀錄：每張處理過的影像記錄時間、參數、輪廓外框與均值，.csv 或 .jsonl，空字串代表不記錄
+MEASURE_PATH = ''
+MEASURE_MAX_MB = 100  # 檔案超過此大小時換新檔，舊檔保留
+SCALES = [(1, '原尺寸'), (0.5, '1/2'), (0.25, '1/4'), (0.125, '1/8')]  # 縮小處理的倍率選項
+SPEEDS = [(0.25, '0.25x'), (0.5, '0.5x'), (1, '1x'), (2, '2x'), (4, '4x'), (0, '最快')]  # 封存檔播放速度
+TILE_HEIGHT = 160  # 多個影像來源時，上方縮圖的高度
+# 多行程處理：大於 0 時，即時影像放進共享記憶體交給這麼多個子行程處理，結果依原本順序顯示
+PROCESS_WORKERS = 0
+# 靜止畫面略過處理：縮圖上任一格灰階差超過此值才重新處理，0 代表每張都處理
+CHANGE_THRESHOLD = 8
+TILES = 1  # 大於 1 時，模糊/膨脹/侵蝕切成這麼多條水平條帶平行處理 (4K 大 kernel 時有效)
+PROBE_DEVICES = True  # 啟動後在背景偵測可用的相機與解析度
+PROBE_MAX_INDEX = 4
+# 處理結果與畫框影像輪流寫入的預先配置緩衝區數量；信箱等待中與介面正在顯示的影像都不能被覆寫，至少要 3 個
+OUTPUT_BUFFERS = 3
 
 
 # 即時顯示影像與處理影像
+# 每個影像來源各有一個處理執行緒與自己的參數
 class ProcessThread(QThread):
-    SIGNAL_FRAME = pyqtSignal(np.ndarray)  # 傳遞原圖的信號
-    SIGNAL_HANDLE_IMAGE = pyqtSignal(np.ndarray, int, int)  # 傳遞處理後的影像信號
+    SIGNAL_OPENED = pyqtSignal(bool)  # 來源開啟完成 (是否成功)
+    # 介面元件只能在介面執行緒更新，處理執行緒透過信號傳回
+    SIGNAL_SAVE_ENABLED = pyqtSignal(bool)  # btn_save_path 是否有效
+    SIGNAL_AVG = pyqtSignal(str)  # lb_avg 的文字
 
-    def __init__(self, main):
+    def __init__(self, main, source, tile_view=None):
         super(ProcessThread, self).__init__()
         self.main = main
+        self.source = source  # 影像來源 (sources.FrameSource)
+        self.tile_view = tile_view  # 多來源時上方的縮圖
+        self.recorder = None  # 觸發錄影 (recorder.PreTriggerRecorder)
+        self.measurements = None  # 量測紀錄 (measurement_log.MeasurementLog)，所有來源共用
+        self.pool = None  # 多行程處理 (shared_pool.SharedFramePool)
         self.running = True
         self.isDetectCamera = True
         self.frame = None  # 處理影像的變數
+        self.display_frame = None  # 左側最後顯示的全解析度影像，拍照時使用
         # initialize binary, dilate, erode, gaussian value
         self.binary_value = 0
         # kernel value
@@ -39,149 +94,353 @@ class ProcessThread(QThread):
         self.blur_value = 1
         self.binary_frame = None  # 預設二值化變數
         self.image_dir = ''  # 設定一個接收匯入圖片的變數
-        self.change_state = False  # 設定 slider_bar modify 的狀態
+        self.scheduler = Scheduler()  # 有新影像、參數變更、載入圖片或停止時喚醒處理
+        self.frame_buffer = FrameRingBuffer(BUFFER_SIZE, self.frame_ready)  # 抓取與處理之間的緩衝區
+        self.capture_thread = None
+        self.timer = main.timer  # 各階段耗時統計
+        self.cache = image_pipeline.PipelineCache(self.timer, TILES, OUTPUT_BUFFERS)  # 各處理階段的快取
+        self.buffers = image_pipeline.BufferPool(OUTPUT_BUFFERS)  # 畫框影像與 ROI 處理結果的緩衝區
+        self.frame_id = 0  # 目前影像的編號，換影像時遞增讓快取失效
+        self.shown_save_enabled = None  # 最後送到介面的值，沒變時不再發送信號
+        self.shown_avg = None
+        self.rois = ()  # 使用者框選的處理範圍 (x, y, w, h)，空的代表整張影像
+        self.roi_caches = {}  # 每個 ROI 各自的階段快取
+        self.scale = 1  # 縮小處理的倍率 (1, 1/2, 1/4, 1/8)
+        self.full_res_mean = True  # 縮小處理時，輪廓均值仍以全解析度影像計算
+        self.had_contours = False  # 上一張影像是否有輪廓，用來判斷輪廓剛出現的時機
+        self.detector = image_pipeline.ChangeDetector(CHANGE_THRESHOLD)  # 畫面變化偵測
+        self.gate_frame = None  # 最後一張有變化的影像 (編號, 影像)
+        self.processed_key = None  # 最後處理時的參數，參數改變時即使畫面靜止也要重算
+        self.first_frame = True  # 還沒顯示過任何影像，用來記錄啟動時間
 
     def run(self):
-        set_pixels(VIDEO)  # 設定像素
+        # 在這個執行緒開啟來源 (相機開啟與設定解析度可能要數秒)，介面不必等待
+        if not self.source.isOpened():
+            with self.timer.stage('open'):
+                self.source.open()
+            self.main.mark_startup('%s %s' % (self.source.name, 'opened' if self.source.isOpened() else 'not opened'))
+        if PROCESS_WORKERS > 0 and self.source.isOpened():
+            self.pool = SharedFramePool(PROCESS_WORKERS, (HEIGHT, WIDTH, 3))
+        self.SIGNAL_OPENED.emit(self.source.isOpened())
+
+        # 來源有開啟時，另外啟動抓取執行緒，處理端永遠取最新的影像；錄影器直接從抓取執行緒取得每一張
+        if self.running and self.source.isOpened() is True:
+            if self.recorder is not None:
+                self.recorder.set_fps(self.source.frame_rate())
+            self.capture_thread = CaptureThread(self.source, self.frame_buffer, self.timer, self.recorder)
+            self.capture_thread.start()
 
         while self.running:
-            time.sleep(0.001)
-            # 相機有開啟
-            if VIDEO.isOpened() is True:
-                ret, frame = VIDEO.read()  # 讀取影像回傳 bool 與 影像，bool 代表相機有讀取到影像
-                if ret:
-                    self.frame = frame
-                    if self.frame.all():
-                        self.main.btn_save_path.setEnabled(True)
-                    else:
-                        self.main.btn_save_path.setEnabled(False)
-                    height, width, img_process = self.handle_image()
-
-                    self.SIGNAL_HANDLE_IMAGE.emit(img_process, height, width)  # 傳遞處理後的影像信號
-
-                    contours, hierarchy = cv2.findContours(img_process, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                    # 複製原圖避免每一次進 for loop 都會被覆蓋
-                    img_draw = self.frame.copy()
-                    for i in range(0, len(contours)):
-                        rx_min, ry_min, rw, rh = cv2.boundingRect(contours[i])
-                        rx_max = rx_min + rw
-                        ry_max = ry_min + rh
-                        # 將繪製矩形的影像再回放
-                        img_draw = cv2.rectangle(img_draw, (rx_min, ry_min), (rx_max, ry_max),
-                                                 (255, 0, 0), 3)
-
-                    if len(contours) != 0:
-                        # 左側畫框的影像
-                        self.SIGNAL_FRAME.emit(img_draw)
-                    else:
-                        # 左側原圖影像
-                        self.SIGNAL_FRAME.emit(self.frame)
+            if self.pool is not None:
+                self.run_pool()
+                continue
+            # 沒有事件時阻塞等待，不輪詢
+            events = self.scheduler.wait()
+            if not self.running:
+                break
+            if self.timer.enabled:
+                for event, latency in events.items():
+                    self.timer.record('wake ' + event, latency)
+
+            # 來源有開啟
+            if self.source.isOpened() is True:
+                item = self.frame_buffer.get_latest(timeout=0)  # 取抓取執行緒送來的最新影像
+                if item is not None:
+                    item = self.gate(item[0], item[2])
+                    if item is None:
+                        continue
+                    self.frame_id, self.frame = item
+                    # 即時影像只畫外框，有 ROI 或要記錄量測時才計算均值
+                    rois = self.rois
+                    img_process, stats, roi_stats = self.analyze(rois, with_mean=self.with_mean())
+                    self.publish(img_process, stats, roi_stats, rois)
 
             else:
-                # 讀取圖片
-                while self.running:
-                    time.sleep(0.001)
-                    # 判斷 讀取影像路徑的變數 和 讀取影像狀態是否成立
-                    if self.main.image_dir and self.main.isLoad_img:
-                        self.frame = cv2.imread(self.main.image_dir)
-                        # 將 讀取到的影像路徑變數放在記憶體中
-                        # self.image_dir = self.main.image_dir
-                        # 因為是按鈕觸發，所以當影像路徑存到變數之後，將狀態改為 False
-                        self.main.isLoad_img = False
-
-                    # 判斷讀取的影像是否成立
-                    if self.frame is not None:
-                        self.main.btn_save_path.setEnabled(True)
-
-                        height, width, img_process = self.handle_image()
-                        self.SIGNAL_HANDLE_IMAGE.emit(img_process, height, width)  # 傳遞處理後的影像
-
-                        # 找輪廓 - 且在原圖上進行繪圖
-                        contours, hierarchy = cv2.findContours(img_process, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                        total_avg = []
-                        img_draw = self.frame.copy()
-                        for i in range(0, len(contours)):
-                            # area = cv2.contourArea(contours[i])  # 取得輪廓面積
-                            rx_min, ry_min, rw, rh = cv2.boundingRect(contours[i])
-                            rx_max = rx_min + rw
-                            ry_max = ry_min + rh
-                            # print(rx_min, ry_min, rx_max, ry_max)
-
-                            rect_ = cv2.rectangle(img_draw, (rx_min, ry_min), (rx_max, ry_max), (255, 0, 0), 3)
-
-                            crop_img = self.frame[ry_min:ry_max, rx_min:rx_max]
-                            text = str(int(crop_img.mean()))  # 計算 RGB 均值
-                            total_avg.append(crop_img.mean())
-                            # 在影像上顯示數值
-                            cv2.putText(rect_, text, (rx_min + int(rw / 2), ry_min + int(rh / 2)), cv2.FONT_HERSHEY_SIMPLEX,
-                                        1, (0, 0, 255), 2)
-
-                        self.main.lb_avg.setText('輪廓總均值:  '+ str(int(sum(total_avg) / len(contours))))
-                        # 狀態改變時，更新視圖
-                        if self.change_state:
-                            if len(contours) != 0:
-
-                                # 左側畫框的影像
-                                self.SIGNAL_FRAME.emit(img_draw)
-                            else:
-                                # 左側原圖影像
-                                self.SIGNAL_FRAME.emit(self.frame)
-
-                            self.change_state = False
+                # 讀取圖片：只有載入新圖 ('load') 或參數變動 ('params') 時才會被喚醒重算；
+                # 事件在處理前就已取出，處理中介面再送來的事件留到下一次喚醒，不會遺失
+                if 'load' in events and self.image_dir:
+                    self.frame = cv2.imread(self.image_dir)
+                    self.frame_id += 1
+                redraw = 'load' in events or 'params' in events
+
+                # 判斷讀取的影像是否成立
+                if self.frame is not None:
+                    selected = self.selected()
+                    if selected:
+                        self.show_save_enabled(True)
+
+                    # 找輪廓 - 且在原圖上進行繪圖
+                    rois = self.rois
+                    img_process, stats, roi_stats = self.analyze(rois)
+                    self.measure(stats, roi_stats)
+                    self.emit_process(img_process)  # 傳遞處理後的影像
+                    if selected:
+                        self.show_avg(format_avg(stats, roi_stats))
+                    # 狀態改變時，更新視圖
+                    if redraw:
+                        if len(stats) != 0 or rois:
+                            # 左側畫框的影像
+                            self.emit_frame(self.draw(stats, show_text=True, rois=rois))
+                        else:
+                            # 左側原圖影像
+                            self.emit_frame(self.frame)
+                    self.count_frame()
+
+    # 顯示處理結果、更新均值與錄影
+    def publish(self, img_process, stats, roi_stats, rois):
+        selected = self.selected()
+        if selected:
+            self.show_save_enabled(bool(self.frame.all()))
+        self.emit_process(img_process)  # 傳遞處理後的影像信號
+        self.measure(stats, roi_stats)
+        if selected and self.with_mean():
+            self.show_avg(format_avg(stats, roi_stats))
+
+        # 錄影：輪廓剛出現時觸發
+        if self.recorder is not None and len(stats) != 0 and not self.had_contours:
+            self.recorder.trigger()
+        self.had_contours = len(stats) != 0
+
+        if len(stats) != 0 or rois:
+            # 左側畫框的影像
+            self.emit_frame(self.draw(stats, rois=rois))
+        else:
+            # 左側原圖影像
+            self.emit_frame(self.frame)
+        self.count_frame()
+        if self.first_frame:
+            self.first_frame = False
+            self.main.mark_startup('%s first frame' % self.source.name)
+
+    # 即時影像是否計算均值：有 ROI 或要記錄量測時
+    def with_mean(self):
+        return bool(self.rois) or self.measurements is not None
+
+    # 把這張影像的處理結果交給量測紀錄 (只放進佇列，不等待寫檔)
+    def measure(self, stats, roi_stats):
+        if self.measurements is not None:
+            self.measurements.record(self.source.name, self.frame_id, self.params(), stats, roi_stats)
+
+    # 數值有變時才發送信號，由介面執行緒更新元件
+    def show_save_enabled(self, enabled):
+        if enabled != self.shown_save_enabled:
+            self.shown_save_enabled = enabled
+            self.SIGNAL_SAVE_ENABLED.emit(enabled)
+
+    def show_avg(self, text):
+        if text != self.shown_avg:
+            self.shown_avg = text
+            self.SIGNAL_AVG.emit(text)
+
+    # 抓取執行緒放入新影像時呼叫
+    def frame_ready(self):
+        self.scheduler.notify('frame')
+
+    # 畫面沒有明顯變化時改用上一張處理過的影像 (各階段快取會直接命中)，
+    # 參數也沒變時回傳 None，整張略過，畫面維持上一次的結果
+    def gate(self, frame_id, frame):
+        key = (self.params(), self.rois, self.scale, self.full_res_mean)
+        if self.gate_frame is None or self.detector.changed(frame):
+            self.gate_frame = (frame_id, frame)
+        else:
+            if self.timer.enabled:
+                self.timer.set_counter('skipped', self.detector.skipped)
+            if key == self.processed_key:
+                return None
+        self.processed_key = key
+        return self.gate_frame
+
+    # 多行程模式：槽位有空就送出最新的影像，已完成的結果依送出順序顯示
+    def run_pool(self):
+        pool = self.pool
+        while self.running:
+            if pool.has_free():
+                # 還有處理中的影像時只短暫等待新影像，以便盡快取回結果
+                item = self.frame_buffer.get_latest(timeout=0.005 if pool.in_flight() else 0.1)
+                if item is not None:
+                    item = self.gate(item[0], item[2])
+                if item is not None:
+                    frame_id, frame = item
+                    rois = self.rois
+                    if not pool.fits(frame):
+                        # 影像比槽位大：先取回處理中的結果，再於執行緒內處理
+                        self.drain_pool()
+                        self.frame_id, self.frame = frame_id, frame
+                        img_process, stats, roi_stats = self.analyze(rois, with_mean=self.with_mean())
+                        self.publish(img_process, stats, roi_stats, rois)
+                        continue
+                    pool.submit(frame, frame_id, self.params(), rois, self.with_mean(), self.scale,
+                                self.full_res_mean)
+            result = pool.get(timeout=0 if pool.has_free() else 0.1)
+            if result is not None:
+                self.publish_result(result)
+            if pool.broken:
+                # 子行程異常結束：取回剩下的結果後關閉，之後改在這個執行緒內處理
+                self.drain_pool()
+                self.pool = None
+                pool.close()
+                return
+
+    def drain_pool(self):
+        while self.pool.in_flight():
+            result = self.pool.get(timeout=1)
+            if result is None:
+                break
+            self.publish_result(result)
+
+    def publish_result(self, result):
+        if result.error is not None:
+            print(result.error)
+            return
+        if self.timer.enabled:
+            self.timer.record('pool', result.latency)
+        self.frame_id, self.frame = result.frame_id, result.frame
+        rois = self.rois
+        self.publish(result.img_process, result.stats, result.roi_stats, rois)
 
     # 影像處理
     def handle_image(self):
-        # 影像處理之前會先做二值化
-        gray = cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
-        _, self.binary_frame = cv2.threshold(gray, self.binary_value, 255, cv2.THRESH_BINARY)
-        # _, self.binary_frame = cv2.threshold(gray, self.binary_value, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-
-        img_process = cv2.GaussianBlur(self.binary_frame, (self.blur_value, self.blur_value), 10)
-
-        kernel_dilate = np.ones((self.dilate_value, self.dilate_value), np.uint8)  # 膨脹 kernel
-        img_process = cv2.dilate(img_process, kernel_dilate, iterations=1)
-
-        kernel_erode = np.ones((self.erode_value, self.erode_value), np.uint8)  # 侵蝕 kernel
-        img_process = cv2.erode(img_process, kernel_erode, iterations=1)
+        self.binary_frame, img_process = self.cache.handle_image(self.frame, self.frame_id, *self.params(),
+                                                                 scale=self.scale)
 
         height, width = img_process.shape[:2]
 
         return height, width, img_process
 
-    # slider bar 觸發連接
-    def update_process(self):
-        object_name = self.sender().objectName()
-
+    # 整張影像或只在 ROI 內處理，回傳處理後的影像、所有輪廓統計、各 ROI 的輪廓統計
+    def analyze(self, rois, with_mean=True):
+        if not rois:
+            height, width, img_process = self.handle_image()
+            stats = self.cache.contour_stats(self.frame, self.frame_id, self.params(), img_process, with_mean,
+                                             self.scale, self.full_res_mean)
+            return img_process, stats, None
+
+        img_process, roi_stats = image_pipeline.process_rois(self.frame, self.frame_id, self.params(), rois,
+                                                             self.roi_caches, with_mean, self.timer,
+                                                             self.scale, self.full_res_mean,
+                                                             self.buffers.get('rois', self.frame.shape[:2]))
+        return img_process, np.concatenate(roi_stats), roi_stats
+
+    # 在原圖上畫出輪廓外框與 ROI 範圍
+    def draw(self, stats, show_text=False, rois=()):
+        with self.timer.stage('draw'):
+            img_draw = image_pipeline.draw_contours(self.frame, stats, show_text,
+                                                    self.buffers.get('draw', self.frame.shape, self.frame.dtype))
+            return image_pipeline.draw_rois(img_draw, rois)
+
+    # 設定縮小處理的倍率與均值計算方式，重新計算
+    def set_scale(self, scale, full_res_mean=None):
+        self.scale = scale
+        if full_res_mean is not None:
+            self.full_res_mean = full_res_mean
+        self.scheduler.notify('params')
+
+    # 設定新的 ROI，重新計算
+    def set_rois(self, rois):
+        rois = tuple(tuple(int(v) for v in roi) for roi in rois)
+        self.roi_caches = {roi: cache for roi, cache in self.roi_caches.items() if roi in rois}
+        self.rois = rois
+        self.scheduler.notify('params')
+
+    # 是否為介面上目前選取的來源
+    def selected(self):
+        return self.main.camera_thread is self
+
+    # 在執行緒內先縮小到左側視窗 (與縮圖) 的大小，放進對應的信箱
+    def emit_frame(self, img):
+        with self.timer.stage('emit'):
+            self.display_frame = img
+            if self.tile_view is not None:
+                self.tile_view.post(fit_to_view(img, self.tile_view.size))
+            if self.selected():
+                self.main.view_origin.post(fit_to_view(img, self.main.view_origin.size))
+
+    # 在執行緒內先縮小到右側視窗的大小，放進右側的信箱
+    def emit_process(self, img):
+        if not self.selected():
+            return
+        with self.timer.stage('emit'):
+            self.main.view_process.post(fit_to_view(img, self.main.view_process.size))
+
+    # 載入圖片 (來源沒有開啟時使用)，路徑在通知前設定，處理端被喚醒時一定讀得到
+    def request_load(self, path):
+        self.image_dir = path
+        self.scheduler.notify('load')
+
+    # 每處理完一張影像更新 fps 與張數統計
+    def count_frame(self):
+        if self.timer.enabled:
+            self.timer.tick('process')
+            for name, value in self.frame_stats().items():
+                self.timer.set_counter(name, value)
+
+    # 目前的處理參數 (二值化, 高斯模糊, 膨脹, 侵蝕)
+    def params(self):
+        return self.binary_value, self.blur_value, self.dilate_value, self.erode_value
+
+    # 依元件名稱設定參數
+    def set_param(self, object_name, value):
         if object_name == 'slider_binary':
-            self.binary_value = self.sender().value()
+            self.binary_value = value
             self.main.label_binary.setText(str(self.binary_value))
-            self.change_state = True
 
         elif object_name == 'slider_dilate':
-            self.dilate_value = self.sender().value()
+            self.dilate_value = value
             self.main.label_dilate.setText(str(self.dilate_value))
-            self.change_state = True
 
         elif object_name == 'slider_erode':
-            self.erode_value = self.sender().value()
+            self.erode_value = value
             self.main.label_erode.setText(str(self.erode_value))
-            self.change_state = True
 
         elif object_name == 'spinBox_guass':
-            self.blur_value = self.sender().value()
-            self.change_state = True
+            self.blur_value = value
+
+        self.scheduler.notify('params')  # 喚醒圖片模式重新計算
+
+    # 抓取、處理、丟棄的影像張數
+    def frame_stats(self):
+        stats = self.frame_buffer.stats()
+        # 緩衝區累計配置量：穩定運作時不再增加，持續增加代表每張影像都在重新配置
+        allocated = self.cache.buffers.allocated_bytes + self.buffers.allocated_bytes + sum(
+            cache.buffers.allocated_bytes for cache in self.roi_caches.values())
+        stats['buffers MB'] = round(allocated / 2 ** 20, 1)
+        rss = peak_rss_mb()
+        if rss is not None:
+            stats['peak RSS MB'] = rss
+        if self.measurements is not None:
+            measure = self.measurements.stats()
+            stats['measure backlog'], stats['measure dropped'] = measure['backlog'], measure['dropped']
+        if self.recorder is not None:
+            record = self.recorder.stats()
+            stats['record events'], stats['record dropped'] = record['events'], record['dropped']
+            stats['recording'] = record['recording']
+        return stats
 
     def stop(self):
         self.running = False
-        VIDEO.release()
+        self.scheduler.notify('stop')
+        if self.capture_thread is not None:
+            self.capture_thread.stop()
+            self.capture_thread.join(timeout=1)
+        self.source.release()
+        if self.recorder is not None:
+            self.recorder.close()
+        pool = self.pool
+        if pool is not None:
+            self.wait(1000)  # 等處理迴圈離開後才釋放共享記憶體
+            pool.close()
 
 
 class ImageProcess(QMainWindow, camera_ui.Ui_MainWindow):
     SIGNAL_SHOW_DIALOG = pyqtSignal()  # 開啟對話方塊的信號
 
-    def __init__(self):
+    def __init__(self, sources=None):
         super(ImageProcess, self).__init__()
         self.setupUi(self)
+        if not sources:
+            sources = [CameraSource(COM, WIDTH, HEIGHT)]
+        self.startup = {}  # 啟動各階段距離程式開始的毫秒數
+        self.lock = threading.Lock()
 
         self.setFixedSize(1280, 768)  # 設定介面大小
         self.setWindowTitle('CamaraCapture')  # 介面標題
@@ -198,44 +457,211 @@ class ImageProcess(QMainWindow, camera_ui.Ui_MainWindow):
         self.frame = None
         self.save_path = ''
 
+        self.timer = StageTimer(METRICS_ENABLED)  # 各階段耗時統計
+        self.metrics_dumper = None
+        if METRICS_ENABLED and METRICS_DUMP_PATH:
+            self.metrics_dumper = MetricsDumper(self.timer, METRICS_DUMP_PATH, METRICS_DUMP_INTERVAL)
+            self.metrics_dumper.start()
+
+        # 每個 QGraphicsView 只保留一個常駐的 pixmap item，之後只更新內容
+        self.view_origin = FrameView(self.graph_origin, DISPLAY_FPS, self.timer, 'origin')  # 原始畫面
+        self.view_process = FrameView(self.graph_process, DISPLAY_FPS, self.timer, 'process')  # 調整的畫面
+
+        # 統計數字浮在左側畫面的左上角，不放進版面，不會擠壓畫面大小；滑鼠事件穿透給下方的畫面 (框選 ROI)
+        self.lb_metrics = QLabel(self.graph_origin)
+        self.lb_metrics.setStyleSheet('color:rgb(255, 255, 255); background-color:rgba(0, 0, 0, 160); '
+                                      'font-family: monospace')
+        self.lb_metrics.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.lb_metrics.move(4, 4)
+        self.lb_metrics.setVisible(METRICS_ENABLED and METRICS_OVERLAY)
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.timeout.connect(self.update_metrics)
+        if METRICS_ENABLED and METRICS_OVERLAY:
+            self.metrics_timer.start(500)
+
+        # 多個來源時在上方並排顯示縮圖，下方的大畫面與參數屬於目前選取的來源
+        self.tiles_layout = QHBoxLayout()
+        tile_views = [None] * len(sources)
+        if len(sources) > 1:
+            for i in range(len(sources)):
+                graph = QGraphicsView(self.centralwidget)
+                graph.setFixedHeight(TILE_HEIGHT)
+                self.tiles_layout.addWidget(graph)
+                tile_views[i] = FrameView(graph, DISPLAY_FPS, self.timer, 'tile%d' % i)
+            self.verticalLayout_2.insertLayout(0, self.tiles_layout)
+
+        # 所有來源共用一個量測紀錄，以來源名稱區分
+        self.measurements = MeasurementLog(MEASURE_PATH, MEASURE_MAX_MB * 1024 * 1024) if MEASURE_PATH else None
+
+        # 每個來源一個處理執行緒
+        self.threads = []
+        for source, tile_view in zip(sources, tile_views):
+            thread = ProcessThread(self, source, tile_view)
+            thread.SIGNAL_OPENED.connect(self.source_opened)
+            thread.SIGNAL_SAVE_ENABLED.connect(self.set_save_enabled)
+            thread.SIGNAL_AVG.connect(self.set_avg)
+            thread.measurements = self.measurements
+            # 觸發錄影，多個來源時各自存到子目錄
+            if RECORD_ENABLED:
+                directory = RECORD_DIR if len(sources) == 1 else os.path.join(RECORD_DIR, safe_name(source.name))
+                thread.recorder = PreTriggerRecorder(directory, RECORD_PRE_SECONDS, RECORD_POST_SECONDS, RECORD_FPS,
+                                                     RECORD_MAX_MB * 1024 * 1024,
+                                                     segment_seconds=RECORD_SEGMENT_SECONDS)
+            self.threads.append(thread)
+        self.camera_thread = self.threads[0]  # 目前選取的來源
+
         # 打開應用程式就啟動執行緒捕捉畫面
-        self.camera_thread = ProcessThread(self)
-        self.camera_thread.SIGNAL_FRAME.connect(self.display_video)
-        self.camera_thread.SIGNAL_HANDLE_IMAGE.connect(self.display_process_video)
-        self.camera_thread.start()
+        for thread in self.threads:
+            thread.start()
         # Slider Bar 變動的連接
-        self.slider_binary.valueChanged.connect(self.camera_thread.update_process)
-        self.slider_dilate.valueChanged.connect(self.camera_thread.update_process)
-        self.slider_erode.valueChanged.connect(self.camera_thread.update_process)
+        self.slider_binary.valueChanged.connect(self.update_process)
+        self.slider_dilate.valueChanged.connect(self.update_process)
+        self.slider_erode.valueChanged.connect(self.update_process)
         # SpinBox 變動的連接
-        self.spinBox_guass.valueChanged.connect(self.camera_thread.update_process)
+        self.spinBox_guass.valueChanged.connect(self.update_process)
 
         self.btn_upload.clicked.connect(self.open_upload_dialog)
 
-        # 當相機開啟時，匯入圖片按鈕無效
-        if VIDEO.isOpened():
-            self.btn_upload.setEnabled(False)
-
-        else:
-            self.btn_upload.setEnabled(True)
+        # 來源開啟完成前，匯入圖片按鈕先維持無效
+        self.btn_upload.setEnabled(False)
 
         self.SIGNAL_SHOW_DIALOG.connect(self.show_dialog)  # 傳遞開啟對話視窗的連接
 
-        self.scene_origin = QGraphicsScene()  # 原始畫面
-        self.scene_adjusting = QGraphicsScene()  # 調整的畫面
-
         self.image_dir = None  # 讀取圖片路徑的變數
-        self.isLoad_img = False  # 讀取圖片的狀態
+
+        # 事件迴圈開始處理事件時，視窗即可操作；之後在背景偵測可用的相機
+        QTimer.singleShot(0, lambda: self.mark_startup('window ready'))
+        self.probe_thread = None
+        if PROBE_DEVICES:
+            QTimer.singleShot(0, self.start_probe)
+
+        # 選擇要調整與放大顯示的來源
+        self.combo_source = QComboBox(self.centralwidget)
+        self.combo_source.setStyleSheet('color:rgb(255, 255, 255)')
+        for source in sources:
+            self.combo_source.addItem(source.name)
+        self.combo_source.setVisible(len(sources) > 1)
+        self.gridLayout.addWidget(self.combo_source, 2, 3, 1, 1)
+        self.combo_source.currentIndexChanged.connect(self.select_source)
+
+        # 封存檔播放控制 (位置與速度)，選取的來源是封存檔時才顯示
+        self.slider_position = QSlider(Qt.Horizontal, self.centralwidget)
+        self.slider_position.valueChanged.connect(self.seek_archive)
+        self.combo_speed = QComboBox(self.centralwidget)
+        for speed, text in SPEEDS:
+            self.combo_speed.addItem(text, speed)
+        self.combo_speed.setCurrentIndex(self.combo_speed.findData(1))
+        self.combo_speed.currentIndexChanged.connect(self.change_speed)
+        self.lb_position = QLabel(self.centralwidget)
+        self.playback_layout = QHBoxLayout()
+        for widget in (self.slider_position, self.combo_speed, self.lb_position):
+            widget.setStyleSheet('color:rgb(255, 255, 255)')
+            self.playback_layout.addWidget(widget)
+        self.verticalLayout_2.insertLayout(self.verticalLayout_2.count() - 3, self.playback_layout)
+        self.playback_timer = QTimer(self)
+        self.playback_timer.timeout.connect(self.update_playback)
+        self.playback_timer.start(200)
+        self.update_playback()
+
+        # 縮小處理的倍率，kernel 會等比例縮小，外框換算回原尺寸
+        self.combo_scale = QComboBox(self.centralwidget)
+        self.combo_scale.setStyleSheet('color:rgb(255, 255, 255)')
+        for scale, text in SCALES:
+            self.combo_scale.addItem('處理尺寸 ' + text, scale)
+        self.check_full_res = QCheckBox('全解析度均值', self.centralwidget)
+        self.check_full_res.setStyleSheet('color:rgb(255, 255, 255)')
+        self.check_full_res.setChecked(True)
+        self.gridLayout.addWidget(self.combo_scale, 2, 0, 1, 2)
+        self.gridLayout.addWidget(self.check_full_res, 2, 2, 1, 1)
+        self.combo_scale.currentIndexChanged.connect(self.change_scale)
+        self.check_full_res.toggled.connect(self.change_scale)
+
+        # 拍照改由背景執行緒編碼與寫檔，並可連拍
+        self.writer = CaptureWriter(WRITER_WORKERS, WRITER_QUEUE, PNG_COMPRESSION, JPEG_QUALITY)
+        self.combo_format = QComboBox(self.centralwidget)
+        self.combo_format.addItems(['png', 'jpg', 'npy'])
+        self.spin_burst = QSpinBox(self.centralwidget)  # 連拍張數，1 為單張
+        self.spin_burst.setRange(1, 1000)
+        self.spin_burst.setPrefix('連拍 ')
+        self.spin_interval = QSpinBox(self.centralwidget)  # 連拍間隔
+        self.spin_interval.setRange(0, 10000)
+        self.spin_interval.setValue(100)
+        self.spin_interval.setSuffix(' ms')
+        self.lb_capture_status = QLabel(self.centralwidget)
+        self.lb_skipped = QLabel(self.centralwidget)  # 靜止畫面略過的張數
+        for index, widget in enumerate((self.combo_format, self.spin_burst, self.spin_interval,
+                                        self.lb_capture_status, self.lb_skipped)):
+            widget.setStyleSheet('color:rgb(255, 255, 255)')
+            self.horizontalLayout_3.insertWidget(index, widget)
+        self.burst_remaining = 0
+        self.burst_timer = QTimer(self)
+        self.burst_timer.timeout.connect(self.capture_burst_frame)
+        self.capture_status_timer = QTimer(self)
+        self.capture_status_timer.timeout.connect(self.update_capture_status)
+        self.capture_status_timer.timeout.connect(self.update_skipped)
+        self.capture_status_timer.start(500)
+
+        # 在左側畫面拖曳框選 ROI，右鍵清除
+        self.roi_selector = RoiSelector(self.view_origin, self.camera_thread)
+
+        # 儲存 / 載入參數與 ROI 設定
+        self.btn_save_settings = QPushButton('儲存設定', self.centralwidget)
+        self.btn_load_settings = QPushButton('載入設定', self.centralwidget)
+        for index, button in enumerate((self.btn_save_settings, self.btn_load_settings)):
+            button.setFont(self.btn_capture.font())
+            button.setStyleSheet(self.btn_capture.styleSheet())
+            self.horizontalLayout_3.insertWidget(1 + index, button)
+        self.btn_save_settings.clicked.connect(self.save_settings)
+        self.btn_load_settings.clicked.connect(self.load_settings)
+        if os.path.exists(SETTINGS_PATH):
+            self.apply_settings(*settings.load_settings(SETTINGS_PATH))
 
     # 匯入圖片按鈕觸發傳遞信號
     def open_upload_dialog(self):
 
         self.SIGNAL_SHOW_DIALOG.emit()
 
+    # 記錄啟動時間 (從程式開始執行起算)，各執行緒都可能呼叫
+    def mark_startup(self, name):
+        elapsed = (time.perf_counter() - START_TIME) * 1000
+        with self.lock:
+            self.startup[name] = elapsed
+        self.timer.set_counter('startup ' + name, round(elapsed))
+        if METRICS_ENABLED:
+            print('startup %-32s %8.0f ms' % (name, elapsed))
+
+    # 來源在背景開啟完成，沒有開啟時才能匯入圖片
+    def source_opened(self, opened):
+        if self.sender() is self.camera_thread:
+            self.btn_upload.setEnabled(not opened)
+
+    # 處理執行緒傳回的介面更新，只採用目前選取的來源
+    def set_save_enabled(self, enabled):
+        if self.sender() is self.camera_thread:
+            self.btn_save_path.setEnabled(enabled)
+
+    def set_avg(self, text):
+        if self.sender() is self.camera_thread:
+            self.lb_avg.setText(text)
+
+    def start_probe(self):
+        in_use = [thread.source.index for thread in self.threads if isinstance(thread.source, CameraSource)]
+        self.probe_thread = DeviceProbe(PROBE_MAX_INDEX, in_use)
+        self.probe_thread.SIGNAL_DONE.connect(self.probe_done)
+        self.probe_thread.start()
+
+    # 偵測結果顯示在來源選單的提示文字
+    def probe_done(self, devices):
+        self.mark_startup('probe done')
+        lines = ['cam:%d (%s) %s' % (device['index'], device['backend'],
+                                     ', '.join('%dx%d@%g' % mode for mode in device['modes']))
+                 for device in devices]
+        self.combo_source.setToolTip('\n'.join(['可用的其他相機:'] + lines) if lines else '沒有偵測到其他相機')
+
     # 彈出匯入圖片的對話視窗
     def show_dialog(self):
         # 相機未開啟
-        if VIDEO.isOpened() is not True:
+        if self.camera_thread.source.isOpened() is not True:
 
             self.image_dir, _ = QFileDialog.getOpenFileName(self, '載入圖像', 'D:',
                                                             "Image Files (*.jpg *.jpeg *.png)")  # 設置文件擴展名過濾,用雙分號間隔
@@ -248,19 +674,7 @@ class ImageProcess(QMainWindow, camera_ui.Ui_MainWindow):
 
                 else:
                     self.lb_upload_path.setText(self.image_dir)
-                    self.isLoad_img = True
-                    self.camera_thread.change_state = True
-
-    @pyqtSlot(np.ndarray, int, int)  # 調整影像執行緒的信號槽
-    def display_process_video(self, npImg, height, width):
-
-        qimg = get_q_img(img=npImg, w=width, h=height)
-        self.scene_adjusting.clear()  # 動態執行影像，清理Scene
-        self.scene_adjusting.addPixmap(QPixmap(qimg))
-        # 設定 QGraphicsScene 的大小
-        self.scene_adjusting.setSceneRect(0, 0, QPixmap(qimg).width(), QPixmap(qimg).height())
-        self.graph_process.setScene(self.scene_adjusting)
-        self.graph_process.fitInView(self.scene_adjusting.sceneRect(), Qt.KeepAspectRatio)
+                    self.camera_thread.request_load(self.image_dir)
 
     # 開啟選取儲存路徑資料夾的按鈕事件
     def open_select_dir_dialog(self):
@@ -288,58 +702,329 @@ class ImageProcess(QMainWindow, camera_ui.Ui_MainWindow):
         else:
             self.save_path = ''
 
-    @pyqtSlot(np.ndarray)  # 顯示影像執行緒的信號槽
-    def display_video(self, frame):
-        self.frame = frame
-        height, width = frame.shape[:2]
-        qimg = QImage(bytes(frame), width, height, 3 * width, QImage.Format_BGR888)
-        self.scene_origin.clear()  # 動態執行影像，清理Scene
-        self.scene_origin.addPixmap(QPixmap(qimg))
-
-        # 設定 QGraphicsScene 的大小
-        self.scene_origin.setSceneRect(0, 0, QPixmap(qimg).width(), QPixmap(qimg).height())
-        self.graph_origin.setScene(self.scene_origin)
-        self.graph_origin.fitInView(self.scene_origin.sceneRect(), Qt.KeepAspectRatio)
+    # slider / spinbox 變動時，只調整目前選取來源的參數
+    def update_process(self):
+        self.camera_thread.set_param(self.sender().objectName(), self.sender().value())
+
+    # 切換選取的來源：介面上的參數改為顯示該來源的設定
+    def select_source(self, index):
+        thread = self.threads[index]
+        self.camera_thread = thread
+        self.roi_selector.thread = thread
+        widgets = (self.slider_binary, self.spinBox_guass, self.slider_dilate, self.slider_erode,
+                   self.combo_scale, self.check_full_res)
+        for widget in widgets:
+            widget.blockSignals(True)
+        self.slider_binary.setValue(thread.binary_value)
+        self.spinBox_guass.setValue(thread.blur_value)
+        self.slider_dilate.setValue(thread.dilate_value)
+        self.slider_erode.setValue(thread.erode_value)
+        self.combo_scale.setCurrentIndex(max(0, self.combo_scale.findData(thread.scale)))
+        self.check_full_res.setChecked(thread.full_res_mean)
+        for widget in widgets:
+            widget.blockSignals(False)
+        self.label_binary.setText(str(thread.binary_value))
+        self.label_dilate.setText(str(thread.dilate_value))
+        self.label_erode.setText(str(thread.erode_value))
+        self.lb_avg.setText('')
+        thread.shown_save_enabled = thread.shown_avg = None  # 讓新選取的來源重新送出目前的值
+        self.btn_upload.setEnabled(not thread.source.isOpened())
+        thread.processed_key = None  # 靜止畫面也要重新顯示到大畫面
+        if isinstance(thread.source, ArchiveSource):
+            self.combo_speed.blockSignals(True)
+            self.combo_speed.setCurrentIndex(max(0, self.combo_speed.findData(thread.source.speed)))
+            self.combo_speed.blockSignals(False)
+        self.update_playback()
+        # 圖片模式下立即重畫
+        thread.scheduler.notify('params')
+
+    # 拖曳位置滑桿時跳到該張影像
+    def seek_archive(self, index):
+        source = self.camera_thread.source
+        if isinstance(source, ArchiveSource) and source.archive is not None:
+            source.seek(index)
+
+    def change_speed(self):
+        source = self.camera_thread.source
+        if isinstance(source, ArchiveSource):
+            source.set_speed(self.combo_speed.currentData())
+
+    # 顯示封存檔的播放位置，不是封存檔時隱藏播放控制
+    def update_playback(self):
+        source = self.camera_thread.source
+        archive = source.archive if isinstance(source, ArchiveSource) else None
+        for widget in (self.slider_position, self.combo_speed, self.lb_position):
+            widget.setVisible(isinstance(source, ArchiveSource))
+        if archive is None or len(archive) == 0:
+            return
+        position = min(source.position, len(archive) - 1)
+        if not self.slider_position.isSliderDown():
+            self.slider_position.blockSignals(True)
+            self.slider_position.setRange(0, len(archive) - 1)
+            self.slider_position.setValue(position)
+            self.slider_position.blockSignals(False)
+        self.lb_position.setText('%d/%d  %.1f/%.1f s' % (position + 1, len(archive),
+                                                         archive.timestamps[position] - archive.timestamps[0],
+                                                         archive.duration()))
+
+    # 縮小倍率或均值計算方式改變
+    def change_scale(self):
+        self.camera_thread.set_scale(self.combo_scale.currentData(), self.check_full_res.isChecked())
+
+    # 選擇檔案儲存目前的參數與 ROI
+    def save_settings(self):
+        path, _ = QFileDialog.getSaveFileName(self, '儲存設定', SETTINGS_PATH, 'Settings (*.json)')
+        if path:
+            thread = self.camera_thread
+            settings.save_settings(path, thread.params(), thread.rois,
+                                   {'scale': thread.scale, 'full_res_mean': thread.full_res_mean})
+
+    # 選擇設定檔載入參數與 ROI
+    def load_settings(self):
+        path, _ = QFileDialog.getOpenFileName(self, '載入設定', SETTINGS_PATH, 'Settings (*.json)')
+        if path:
+            self.apply_settings(*settings.load_settings(path))
+
+    # 套用參數到 slider 與處理執行緒
+    def apply_settings(self, params, rois, options=None):
+        options = options or {}
+        binary, blur, dilate, erode = params
+        self.slider_binary.setValue(binary)
+        self.spinBox_guass.setValue(blur)
+        self.slider_dilate.setValue(dilate)
+        self.slider_erode.setValue(erode)
+        # slider 數值沒變時不會觸發 valueChanged，直接同步到執行緒
+        thread = self.camera_thread
+        thread.binary_value, thread.blur_value, thread.dilate_value, thread.erode_value = params
+        self.label_binary.setText(str(binary))
+        self.label_dilate.setText(str(dilate))
+        self.label_erode.setText(str(erode))
+        thread.set_rois(rois)
+        index = self.combo_scale.findData(options.get('scale', 1))
+        self.combo_scale.setCurrentIndex(max(0, index))
+        self.check_full_res.setChecked(options.get('full_res_mean', True))
+
+    # 更新畫面上的統計數字
+    def update_metrics(self):
+        self.lb_metrics.setText(self.timer.format_overlay())
+        self.lb_metrics.adjustSize()
 
     # 拍照
     def capture(self):
-
-        if os.path.exists(self.save_path):
-            # 設定要儲存的影像檔名格式
-            date_time = str(datetime.datetime.today())
-            # print(date_time)
-            mDate, mTime = date_time.split(' ')
-            mDate = mDate.replace('-', '')
-            mTime = mTime.replace(':', '').replace('.', '')[:-2]
-            img_name = mDate + '_' + mTime + '.png'
-
-            cv2.imwrite(os.path.join(self.save_path, img_name), self.frame)
-            # print('儲存影像: ' + os.path.join(self.save_path, img_name))
+        if not os.path.exists(self.save_path):
+            return
+        # 連拍：每隔 interval 取一張最新的影像
+        self.burst_remaining = self.spin_burst.value()
+        self.capture_burst_frame()
+        if self.burst_remaining > 0:
+            self.burst_timer.start(self.spin_interval.value())
+
+    # 把目前最新的全解析度影像交給背景存檔
+    def capture_burst_frame(self):
+        self.frame = self.camera_thread.display_frame  # 拍照使用全解析度的影像
+        if self.frame is not None:
+            self.writer.submit(self.frame, self.save_path, self.combo_format.currentText())
+        self.burst_remaining -= 1
+        if self.burst_remaining <= 0:
+            self.burst_timer.stop()
+
+    # 顯示存檔進度，佇列接近上限或有丟棄時代表磁碟跟不上
+    def update_capture_status(self):
+        stats = self.writer.stats()
+        if stats['submitted'] == 0 and stats['dropped'] == 0:
+            return
+        text = '已存 %d  佇列 %d/%d' % (stats['written'], stats['backlog'], stats['capacity'])
+        if stats['dropped']:
+            text += '  丟棄 %d' % stats['dropped']
+        self.lb_capture_status.setText(text)
+        full = stats['dropped'] > 0 or stats['backlog'] >= stats['capacity'] * 0.8
+        self.lb_capture_status.setStyleSheet('color:rgb(255, 80, 80)' if full else 'color:rgb(255, 255, 255)')
+
+    # 顯示目前來源因畫面靜止而略過處理的張數
+    def update_skipped(self):
+        detector = self.camera_thread.detector
+        if detector.checked:
+            self.lb_skipped.setText('靜止略過 %d/%d (%.0f%%)' % (detector.skipped, detector.checked,
+                                                            detector.skipped * 100.0 / detector.checked))
 
     # 離開應用程式
     def close_sys(self):
         try:
-            self.camera_thread.stop()
+            for thread in self.threads:
+                thread.stop()
+            self.writer.close(wait=True)  # 等待尚未寫完的影像
+            if self.measurements is not None:
+                self.measurements.close()  # 等待尚未寫入的量測紀錄
+            if self.metrics_dumper is not None:
+                self.metrics_dumper.stop()
+                self.timer.dump(METRICS_DUMP_PATH)  # 離開前再輸出一次
             sys.exit()
         except Exception as exc:
             print(exc)
 
 
-# 設定相機解析度
-def set_pixels(cap):
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, WIDTH)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, HEIGHT)
-    cap.set(cv2.CAP_PROP_FPS, 24)  # FPS
+# 輪廓總均值的文字，有 ROI 時改為分別列出每個 ROI 的均值
+def format_avg(stats, roi_stats=None):
+    if roi_stats is None:
+        avg = image_pipeline.total_mean(stats)
+        return '輪廓總均值:  ' + (str(int(avg)) if avg is not None else '-')
+    texts = []
+    for i, stats in enumerate(roi_stats):
+        avg = image_pipeline.total_mean(stats)
+        texts.append('ROI%d: %s' % (i + 1, str(int(avg)) if avg is not None else '-'))
+    return '  '.join(texts)
+
+
+# 背景偵測可用的相機與支援的解析度，不佔用介面執行緒
+class DeviceProbe(QThread):
+    SIGNAL_DONE = pyqtSignal(list)
+
+    def __init__(self, max_index, skip=()):
+        super(DeviceProbe, self).__init__()
+        self.max_index = max_index
+        self.skip = tuple(skip)
+
+    def run(self):
+        self.SIGNAL_DONE.emit(probe_cameras(self.max_index, skip=self.skip))
+
+
+# 來源名稱轉成可當目錄名稱的字串
+def safe_name(name):
+    return re.sub(r'[^0-9A-Za-z_.-]+', '_', name)
+
+
+# 等比例縮小影像到視窗可顯示的大小，影像本身較小時不放大
+def fit_to_view(img, size):
+    view_w, view_h = size
+    height, width = img.shape[:2]
+    if view_w <= 0 or view_h <= 0 or min(view_w / width, view_h / height) >= 1:
+        return np.ascontiguousarray(img)
+    scale = min(view_w / width, view_h / height)
+    return cv2.resize(img, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
+
+# 包裝 QGraphicsView：常駐一個 QGraphicsPixmapItem，並記錄 viewport 大小給處理執行緒使用
+# 處理執行緒把影像放進信箱，介面以不超過 max_fps 的頻率取出最新的一張顯示
+class FrameView(QObject):
+    SIGNAL_PENDING = pyqtSignal()  # 信箱從空變成有影像時通知介面
+
+    def __init__(self, view, max_fps=0, timer=None, name='view'):
+        super(FrameView, self).__init__(view)
+        self.view = view
+        self.timer = timer if timer is not None else StageTimer(enabled=False)
+        self.name = name
+        self.mailbox = FrameMailbox()
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.last_show = 0.0
+        self.SIGNAL_PENDING.connect(self.deliver)
+        self.scene = QGraphicsScene()
+        self.item = QGraphicsPixmapItem()
+        self.scene.addItem(self.item)
+        self.view.setScene(self.scene)
+        self.view.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.view.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.size = (view.viewport().width(), view.viewport().height())
+        self.view.viewport().installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Resize:
+            self.size = (event.size().width(), event.size().height())
+            self.fit()
+        return False
+
+    # 處理執行緒呼叫：只有信箱原本為空時才發出通知，避免事件佇列堆積
+    def post(self, img):
+        if self.mailbox.post(img):
+            self.SIGNAL_PENDING.emit()
+
+    @pyqtSlot()
+    def deliver(self):
+        # 還沒到下一次可更新的時間，延後到時間到再取最新的影像
+        wait = self.last_show + self.min_interval - time.perf_counter()
+        if wait > 0:
+            QTimer.singleShot(int(wait * 1000) + 1, self.deliver)
+            return
+        img = self.mailbox.take()
+        if img is not None:
+            self.last_show = time.perf_counter()
+            with self.timer.stage('paint_' + self.name):
+                self.show(img)
+            self.timer.tick('display_' + self.name)
+
+    def show(self, img):
+        height, width = img.shape[:2]
+        # QImage 直接包住 numpy 的記憶體，不另外複製
+        pixmap = QPixmap.fromImage(get_q_img(img=img, w=width, h=height))
+        resized = pixmap.size() != self.item.pixmap().size()
+        self.item.setPixmap(pixmap)
+        if resized:
+            self.scene.setSceneRect(0, 0, width, height)
+            self.fit()
+
+    def fit(self):
+        self.view.fitInView(self.scene.sceneRect(), Qt.KeepAspectRatio)
+
+
+# 在 FrameView 上以滑鼠拖曳框選 ROI，座標換算回全解析度影像後交給處理執行緒，右鍵清除所有 ROI
+class RoiSelector(QObject):
+    def __init__(self, frame_view, thread):
+        super(RoiSelector, self).__init__(frame_view)
+        self.frame_view = frame_view
+        self.thread = thread
+        self.start = None
+        self.rubber = QGraphicsRectItem()
+        self.rubber.setPen(QPen(QColor(0, 255, 0), 2))
+        self.rubber.setZValue(1)
+        self.rubber.hide()
+        frame_view.scene.addItem(self.rubber)
+        frame_view.view.viewport().installEventFilter(self)
+
+    # 顯示的影像已縮小，依照全解析度影像的寬度換算比例
+    def scale(self):
+        frame = self.thread.display_frame
+        shown = self.frame_view.item.pixmap().width()
+        if frame is None or shown == 0:
+            return None
+        return frame.shape[1] / shown
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.MouseButtonPress:
+            if event.button() == Qt.RightButton:
+                self.thread.set_rois(())
+            elif event.button() == Qt.LeftButton and self.scale() is not None:
+                self.start = self.frame_view.view.mapToScene(event.pos())
+                self.rubber.setRect(self.start.x(), self.start.y(), 0, 0)
+                self.rubber.show()
+            return True
+        if event.type() == QEvent.MouseMove and self.start is not None:
+            end = self.frame_view.view.mapToScene(event.pos())
+            self.rubber.setRect(min(self.start.x(), end.x()), min(self.start.y(), end.y()),
+                                abs(end.x() - self.start.x()), abs(end.y() - self.start.y()))
+            return True
+        if event.type() == QEvent.MouseButtonRelease and self.start is not None:
+            rect = self.rubber.rect()
+            scale = self.scale()
+            self.start = None
+            self.rubber.hide()
+            if scale is not None and rect.width() > 2 and rect.height() > 2:
+                roi = (int(rect.x() * scale), int(rect.y() * scale),
+                       int(rect.width() * scale), int(rect.height() * scale))
+                frame = self.thread.display_frame
+                roi = image_pipeline.clip_roi(roi, frame.shape)
+                if roi is not None:
+                    self.thread.set_rois(self.thread.rois + (roi,))
+            return True
+        return False
 
 
 # 判斷 影像為幾通道，給予對應的 qimg
 def get_q_img(img, w, h):
     # 假如影像有處理就以 2 通道來顯示，否則就以原圖 3 通道呈現
     if len(img.shape) == 2:
-        bytesPerline = w
+        bytesPerline = img.strides[0]
         qimg = QImage(img.data, w, h, bytesPerline, QImage.Format_Grayscale8)
     else:
-        bytesPerline = w * 3
+        bytesPerline = img.strides[0]
         qimg = QImage(img.data, w, h, bytesPerline, QImage.Format_BGR888)
 
     return qimg
@@ -347,6 +1032,7 @@ def get_q_img(img, w, h):
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
-    win = ImageProcess()
+    # 命令列可指定一個或多個影像來源，例如 python main.py 0 1 file:line3.mp4 synthetic:1920x1080
+    win = ImageProcess([create_source(spec, WIDTH, HEIGHT) for spec in sys.argv[1:]])
     win.show()
     sys.exit(app.exec())
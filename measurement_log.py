@@ -0,0 +1,159 @@
+import csv
+import datetime
+import io
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+import image_pipeline
+
+CSV_FIELDS = ['time', 'source', 'frame', 'binary', 'blur', 'dilate', 'erode', 'count', 'total_mean', 'roi_means',
+              'boxes', 'means']
+
+
+# 一張影像的量測紀錄：外框為 [x, y, w, h] 清單，均值與外框依相同順序；沒有輪廓時 total_mean 為 None
+def to_record(item):
+    timestamp, source, frame_id, params, stats, roi_stats = item
+    record = {
+        'time': timestamp,
+        'source': source,
+        'frame': frame_id,
+        'params': list(params),
+        'count': len(stats),
+        'total_mean': image_pipeline.total_mean(stats),
+        'boxes': np.stack([stats['x'], stats['y'], stats['w'], stats['h']], 1).tolist(),
+        'means': np.round(stats['mean'], 3).tolist(),
+    }
+    if roi_stats is not None:
+        record['roi_means'] = [image_pipeline.total_mean(s) for s in roi_stats]
+    return record
+
+
+# CSV 每張影像一列，外框與均值清單以 JSON 字串放在同一格
+def to_row(record):
+    return [record['time'], record['source'], record['frame']] + record['params'] + [
+        record['count'], '' if record['total_mean'] is None else record['total_mean'],
+        json.dumps(record['roi_means']) if 'roi_means' in record else '',
+        json.dumps(record['boxes'], separators=(',', ':')), json.dumps(record['means'], separators=(',', ':'))]
+
+
+# 量測紀錄：處理執行緒每張影像呼叫 record() 只把結果放進佇列，不等待；
+# 背景執行緒每 interval 秒 (或累積 batch 筆) 批次寫入 .csv 或 .jsonl (其他副檔名)，只追加不改寫，
+# 檔案超過 max_bytes 時改名加上時間後另開新檔，舊檔全部保留
+class MeasurementLog:
+    def __init__(self, path, max_bytes=100 * 1024 * 1024, max_queue=10000, batch=500, interval=0.5):
+        self.path = path
+        self.csv = path.lower().endswith('.csv')
+        self.max_bytes = max_bytes
+        self.batch = batch
+        self.interval = interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.fp = None
+        # 統計
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0  # 佇列滿了沒能記錄的筆數
+        self.failed = 0
+        self.rotations = 0
+
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    # stats 為 image_pipeline.REGION_DTYPE 陣列，放進佇列後不可再修改 (快取的結果不會被改寫，不必複製)
+    def record(self, source, frame_id, params, stats, roi_stats=None, timestamp=None):
+        item = (time.time() if timestamp is None else timestamp, source, frame_id, tuple(params), stats, roi_stats)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+        with self.lock:
+            self.recorded += 1
+        return True
+
+    def _work(self):
+        running = True
+        while running:
+            item = self.queue.get()
+            items = []
+            deadline = time.perf_counter() + self.interval
+            while item is not None:
+                items.append(item)
+                remaining = deadline - time.perf_counter()
+                if len(items) >= self.batch or remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if items:
+                self._write(items)
+            running = item is not None  # None 代表 close()，前面的紀錄都已寫入
+        if self.fp is not None:
+            self.fp.close()
+
+    def _write(self, items):
+        try:
+            records = [to_record(item) for item in items]
+            fp = self._open()
+            if self.csv:
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(to_row(record) for record in records)
+                fp.write(buffer.getvalue())
+            else:
+                fp.write(''.join(json.dumps(record) + '\n' for record in records))
+            fp.flush()
+        except (OSError, ValueError) as exc:
+            print(exc)
+            with self.lock:
+                self.failed += len(items)
+            return
+        with self.lock:
+            self.written += len(items)
+        if fp.tell() >= self.max_bytes:
+            self._rotate()
+
+    # 接續既有的檔案追加，新檔案 (CSV) 先寫標題列
+    def _open(self):
+        if self.fp is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.fp = open(self.path, 'a', newline='', encoding='utf-8')
+            if self.csv and self.fp.tell() == 0:
+                csv.writer(self.fp).writerow(CSV_FIELDS)
+        return self.fp
+
+    # 目前的檔案改名為 名稱_日期_時間.副檔名，下一批寫入新檔
+    def _rotate(self):
+        self.fp.close()
+        self.fp = None
+        stem, ext = os.path.splitext(self.path)
+        base = '%s_%s' % (stem, datetime.datetime.now().strftime('%Y%m%d_%H%M%S'))
+        target, n = base + ext, 1
+        while os.path.exists(target):
+            target, n = '%s_%d%s' % (base, n, ext), n + 1
+        try:
+            os.replace(self.path, target)
+        except OSError as exc:
+            print(exc)
+            return
+        with self.lock:
+            self.rotations += 1
+
+    def stats(self):
+        with self.lock:
+            return {'recorded': self.recorded, 'written': self.written, 'dropped': self.dropped,
+                    'failed': self.failed, 'backlog': self.queue.qsize(), 'rotations': self.rotations}
+
+    # 結束前等佇列中的紀錄全部寫完
+    def close(self, wait=True):
+        self.queue.put(None)
+        if wait:
+            self.thread.join()
@@ -0,0 +1,147 @@
+import collections
+import contextlib
+import csv
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows 沒有 resource 模組
+    resource = None
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+# 行程到目前為止的最大常駐記憶體 (MB)，無法取得時回傳 None
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 的單位是 KB，macOS 是 byte
+    return round(peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10, 1)
+
+
+# 計時區段：離開 with 時把耗時記錄到對應的階段
+class _Span:
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+# 各階段的滾動延遲統計 (p50/p95/p99) 與實際 fps，停用時 stage() 只回傳共用的空 context
+class StageTimer:
+    def __init__(self, enabled=True, window=500):
+        self.enabled = enabled
+        self.window = window
+        self.samples = {}  # 階段名稱 -> 最近 window 筆耗時 (秒)
+        self.ticks = {}  # 計數名稱 -> 最近 window 筆時間戳，用來算 fps
+        self.counters = {}  # 其他累計數值，例如丟棄張數
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def record(self, name, seconds):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples.setdefault(name, collections.deque(maxlen=self.window))
+        samples.append(seconds)
+
+    def tick(self, name):
+        if not self.enabled:
+            return
+        ticks = self.ticks.get(name)
+        if ticks is None:
+            ticks = self.ticks.setdefault(name, collections.deque(maxlen=self.window))
+        ticks.append(time.perf_counter())
+
+    def set_counter(self, name, value):
+        if self.enabled:
+            self.counters[name] = value
+
+    def fps(self, name):
+        ticks = list(self.ticks.get(name, ()))
+        if len(ticks) < 2 or ticks[-1] == ticks[0]:
+            return 0.0
+        return (len(ticks) - 1) / (ticks[-1] - ticks[0])
+
+    # 各階段的統計摘要，時間單位為毫秒
+    def summary(self):
+        stages = {}
+        for name, samples in list(self.samples.items()):
+            values = np.array(samples, dtype=np.float64) * 1000
+            if len(values) == 0:
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stages[name] = {'count': len(values), 'p50': p50, 'p95': p95, 'p99': p99}
+        return {
+            'time': time.time(),
+            'stages': stages,
+            'fps': {name: self.fps(name) for name in list(self.ticks)},
+            'counters': dict(self.counters),
+        }
+
+    # 介面上顯示用的簡短文字
+    def format_overlay(self):
+        summary = self.summary()
+        lines = ['  '.join('%s %.1f fps' % (name, fps) for name, fps in summary['fps'].items())]
+        for name, s in summary['stages'].items():
+            lines.append('%-16s p50 %6.2f  p95 %6.2f  p99 %6.2f ms' % (name, s['p50'], s['p95'], s['p99']))
+        # 計數每行 4 個，疊加在畫面上時不會超出畫面寬度太多
+        counters = ['%s %s' % item for item in summary['counters'].items()]
+        for i in range(0, len(counters), 4):
+            lines.append('  '.join(counters[i:i + 4]))
+        return '\n'.join(lines)
+
+    # .csv 每個階段追加一列，其他副檔名追加一行 JSON
+    def dump(self, path):
+        summary = self.summary()
+        if path.lower().endswith('.csv'):
+            new_file = not os.path.exists(path)
+            with open(path, 'a', newline='', encoding='utf-8') as fp:
+                writer = csv.writer(fp)
+                if new_file:
+                    writer.writerow(['time', 'stage', 'count', 'p50_ms', 'p95_ms', 'p99_ms'])
+                for name, s in summary['stages'].items():
+                    writer.writerow([summary['time'], name, s['count'], s['p50'], s['p95'], s['p99']])
+                for name, fps in summary['fps'].items():
+                    writer.writerow([summary['time'], name + '_fps', '', fps, '', ''])
+        else:
+            with open(path, 'a', encoding='utf-8') as fp:
+                fp.write(json.dumps(summary) + '\n')
+
+
+# 定期把統計結果寫到檔案的背景執行緒
+class MetricsDumper(threading.Thread):
+    def __init__(self, timer, path, interval=10):
+        super(MetricsDumper, self).__init__(daemon=True)
+        self.timer = timer
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.timer.dump(self.path)
+            except OSError as exc:
+                print(exc)
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,165 @@
+import collections
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+SEND_TIMEOUT = 1.0  # 送出觸發前歷史時，編碼子行程的佇列滿了最多等這麼久
+
+
+# 編碼子行程：接收 JPEG 影像，解碼後寫成分段的影片檔，每段 segment_seconds 秒 (依每次事件的 fps 換算張數)
+def encoder_process(jobs, segment_seconds):
+    writer = None
+    written = 0
+    prefix, fps, part = '', 24, 0
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        kind = job[0]
+        if kind == 'start':
+            _, prefix, fps = job
+            part, written = 0, 0
+            segment_frames = max(1, int(fps * segment_seconds))
+        elif kind == 'frame':
+            frame = cv2.imdecode(np.frombuffer(job[2], np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                continue
+            # 每 segment_frames 張換一個檔案
+            if writer is None or written >= segment_frames:
+                if writer is not None:
+                    writer.release()
+                height, width = frame.shape[:2]
+                path = '%s_%03d.mp4' % (prefix, part)
+                writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+                part, written = part + 1, 0
+            writer.write(frame)
+            written += 1
+        elif kind == 'end' and writer is not None:
+            writer.release()
+            writer = None
+    if writer is not None:
+        writer.release()
+
+
+# 觸發前後錄影：記憶體中以 JPEG 保留最近 pre_seconds 秒的影像 (同時受 max_bytes 限制)，
+# 觸發時把這段歷史加上之後 post_seconds 秒交給編碼子行程寫檔；抓取執行緒只呼叫 push()，不會等待編碼
+# fps 為影片檔的速率，應和來源實際的抓取速率相同 (set_fps)，否則影片會變快或變慢
+class PreTriggerRecorder:
+    def __init__(self, output_dir, pre_seconds=5, post_seconds=5, fps=24, max_bytes=200 * 1024 * 1024,
+                 jpeg_quality=90, segment_seconds=60):
+        self.output_dir = output_dir
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.fps = fps
+        self.max_bytes = max_bytes
+        self.jpeg_quality = jpeg_quality
+        os.makedirs(output_dir, exist_ok=True)
+
+        self.incoming = queue.Queue(maxsize=max(1, int(fps * 2)))  # 抓取執行緒 -> 壓縮執行緒
+        self.history = collections.deque()  # (時間, JPEG bytes)
+        self.history_bytes = 0
+        self.trigger_event = threading.Event()
+        self.record_until = 0.0  # 觸發後錄到這個時間
+        # 統計
+        self.dropped = 0  # 壓縮或編碼跟不上而丟棄的張數
+        self.events = 0
+
+        self.jobs = multiprocessing.Queue(maxsize=fps * 10)
+        self.encoder = multiprocessing.Process(target=encoder_process,
+                                               args=(self.jobs, segment_seconds), daemon=True)
+        self.encoder.start()
+        self.running = True
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    # 之後的事件改用來源的實際速率，0 (未知) 時維持原本的設定
+    def set_fps(self, fps):
+        if fps > 0:
+            self.fps = fps
+
+    # 抓取執行緒呼叫：放入影像與抓取時間，佇列滿時直接丟棄，不阻塞
+    def push(self, frame, timestamp=None):
+        try:
+            self.incoming.put_nowait((time.time() if timestamp is None else timestamp, frame))
+        except queue.Full:
+            self.dropped += 1
+
+    # 觸發錄影，錄影中再次觸發會延長結束時間
+    def trigger(self):
+        self.trigger_event.set()
+
+    def recording(self):
+        return time.time() < self.record_until
+
+    # block 時在這個執行緒等待編碼子行程 (觸發前的歷史一次送出，可能超過佇列大小)
+    def _send(self, job, block=False):
+        try:
+            self.jobs.put(job, block, SEND_TIMEOUT)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _work(self):
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+        while self.running:
+            try:
+                timestamp, frame = self.incoming.get(timeout=0.1)
+            except queue.Empty:
+                timestamp, frame = None, None
+
+            if self.trigger_event.is_set():
+                self.trigger_event.clear()
+                now = time.time() if timestamp is None else timestamp
+                if now >= self.record_until:
+                    # 新的事件：開新檔案並先送出觸發前的歷史
+                    self.events += 1
+                    prefix = os.path.join(self.output_dir, time.strftime('%Y%m%d_%H%M%S', time.localtime(now)))
+                    self._send(('start', prefix, self.fps))
+                    for history_time, data in self.history:
+                        self._send(('frame', history_time, data), block=True)
+                    self.history.clear()
+                    self.history_bytes = 0
+                self.record_until = now + self.post_seconds
+
+            if frame is None:
+                if self.record_until and time.time() >= self.record_until:
+                    self._send(('end',))
+                    self.record_until = 0.0
+                continue
+
+            ret, data = cv2.imencode('.jpg', frame, params)
+            if not ret:
+                continue
+            data = data.tobytes()
+
+            if timestamp < self.record_until:
+                self._send(('frame', timestamp, data))
+                continue
+            if self.record_until:
+                self._send(('end',))
+                self.record_until = 0.0
+
+            # 保留觸發前的歷史，超過時間或記憶體上限就丟掉最舊的
+            self.history.append((timestamp, data))
+            self.history_bytes += len(data)
+            while self.history and (self.history[0][0] < timestamp - self.pre_seconds
+                                    or self.history_bytes > self.max_bytes):
+                self.history_bytes -= len(self.history.popleft()[1])
+
+    def stats(self):
+        return {'history_frames': len(self.history), 'history_bytes': self.history_bytes,
+                'events': self.events, 'dropped': self.dropped, 'recording': self.recording()}
+
+    def close(self):
+        self.running = False
+        self.thread.join(timeout=1)
+        if self.record_until:
+            self._send(('end',))
+        self.jobs.put(None)
+        self.encoder.join(timeout=5)
@@ -0,0 +1,264 @@
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+import image_pipeline
+import settings
+from frame_buffer import CaptureThread, FrameRingBuffer
+from measurement_log import MeasurementLog
+from metrics import StageTimer, peak_rss_mb
+from sources import create_source
+
+BOUNDARY = 'frame'
+INDEX_HTML = b'''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Image_capture</title></head>
+<body style="background:#222;color:#eee;font-family:monospace">
+<img src="/annotated.mjpg" style="max-width:49%"> <img src="/processed.mjpg" style="max-width:49%">
+<pre id="stats"></pre>
+<script>
+new EventSource('/events').onmessage = function (e) {
+  document.getElementById('stats').textContent = JSON.stringify(JSON.parse(e.data), null, 1);
+};
+</script>
+</body></html>
+'''
+
+
+# 只保留最新一份資料的廣播：發布端只換掉參考，不會等待；
+# 每個連線各自取最新的一份，較慢的連線自然跳過中間的影像
+class Broadcast:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.seq = 0
+        self.data = None
+        self.clients = 0
+
+    def publish(self, data):
+        with self.condition:
+            self.seq += 1
+            self.data = data
+            self.condition.notify_all()
+
+    # 等待比 last_seq 新的資料，逾時回傳 (last_seq, None)
+    def wait(self, last_seq, timeout=1.0):
+        with self.condition:
+            if self.seq == last_seq:
+                self.condition.wait(timeout)
+            if self.seq == last_seq:
+                return last_seq, None
+            return self.seq, self.data
+
+    def connect(self):
+        with self.condition:
+            self.clients += 1
+
+    def disconnect(self):
+        with self.condition:
+            self.clients -= 1
+
+
+# 無介面的處理流程：抓取 -> handle_image -> 輪廓統計，結果交給各個廣播；
+# 有人觀看的串流才編碼，每張影像只編碼一次
+class HeadlessPipeline(threading.Thread):
+    def __init__(self, source, params, rois=(), scale=1, full_res_mean=True, quality=80, timer=None,
+                 change_threshold=8, tiles=1, measurements=None):
+        super(HeadlessPipeline, self).__init__(daemon=True)
+        self.source = source
+        self.params = tuple(params)
+        self.rois = tuple(tuple(roi) for roi in rois)
+        self.scale = scale
+        self.full_res_mean = full_res_mean
+        self.jpeg_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        self.timer = timer or StageTimer(enabled=True)
+        self.frame_buffer = FrameRingBuffer(2)
+        self.cache = image_pipeline.PipelineCache(self.timer, tiles)
+        self.roi_caches = {}
+        self.buffers = image_pipeline.BufferPool(1)  # 畫框影像與 ROI 處理結果，編碼完就不再使用，一個就夠
+        self.detector = image_pipeline.ChangeDetector(change_threshold)  # 畫面靜止時略過處理
+        self.watching = 0  # 上次處理時觀看串流的連線數，有新連線時要重新發布
+        self.measurements = measurements  # 量測紀錄 (measurement_log.MeasurementLog)
+        self.annotated = Broadcast()  # 畫上外框的原圖 (JPEG)
+        self.processed = Broadcast()  # 處理後的二值影像 (JPEG)
+        self.stats = Broadcast()  # 每張影像的輪廓統計 (JSON bytes)
+        self.capture_thread = CaptureThread(source, self.frame_buffer, self.timer)
+        self.running = True
+
+    def run(self):
+        self.capture_thread.start()
+        while self.running:
+            item = self.frame_buffer.get_latest(timeout=0.1)
+            if item is None:
+                if not self.capture_thread.is_alive():
+                    break
+                continue
+            frame_id, timestamp, frame = item
+            watching = self.annotated.clients + self.processed.clients
+            if not self.detector.changed(frame) and watching <= self.watching:
+                self.watching = watching
+                self.timer.set_counter('skipped', self.detector.skipped)
+                continue
+            self.watching = watching
+            if self.rois:
+                img_process, roi_stats = image_pipeline.process_rois(frame, frame_id, self.params, self.rois,
+                                                                     self.roi_caches, True, self.timer,
+                                                                     self.scale, self.full_res_mean,
+                                                                     self.buffers.get('rois', frame.shape[:2]))
+                stats = np.concatenate(roi_stats)
+            else:
+                img_process, stats = self.cache.analyze(frame, frame_id, self.params, True, self.scale,
+                                                        self.full_res_mean)
+                roi_stats = None
+
+            if self.measurements is not None:
+                self.measurements.record(self.source.name, frame_id, self.params, stats, roi_stats)
+            result = {
+                'frame': frame_id,
+                'time': time.time(),
+                'latency_ms': (time.perf_counter() - timestamp) * 1000,
+                'contours': [dict(zip(stats.dtype.names, row)) for row in stats.tolist()],
+                'total_mean': image_pipeline.total_mean(stats),
+            }
+            if roi_stats is not None:
+                result['roi_means'] = [image_pipeline.total_mean(s) for s in roi_stats]
+            self.stats.publish(json.dumps(result).encode('utf-8'))
+
+            if self.annotated.clients > 0:
+                with self.timer.stage('draw'):
+                    img_draw = image_pipeline.draw_contours(frame, stats, True,
+                                                            self.buffers.get('draw', frame.shape, frame.dtype))
+                    img_draw = image_pipeline.draw_rois(img_draw, self.rois)
+                self.annotated.publish(self.encode(img_draw))
+            if self.processed.clients > 0:
+                self.processed.publish(self.encode(img_process))
+            self.timer.tick('process')
+            self.timer.set_counter('peak RSS MB', peak_rss_mb())
+        self.capture_thread.stop()
+        self.running = False  # 來源結束時讓串流連線一併結束
+
+    def encode(self, img):
+        with self.timer.stage('encode'):
+            return cv2.imencode('.jpg', img, self.jpeg_params)[1].tobytes()
+
+    def stop(self):
+        self.running = False
+        self.capture_thread.stop()
+        self.join(timeout=1)
+        self.source.release()
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+    timeout = 10  # 卡住的連線在這段時間後斷開
+
+    def do_GET(self):
+        pipeline = self.server.pipeline
+        path = self.path.split('?')[0]
+        if path == '/':
+            self.send_bytes(INDEX_HTML, 'text/html; charset=utf-8')
+        elif path == '/annotated.mjpg':
+            self.send_mjpeg(pipeline.annotated)
+        elif path == '/processed.mjpg':
+            self.send_mjpeg(pipeline.processed)
+        elif path == '/stats':
+            data = pipeline.stats.data
+            self.send_bytes(data if data is not None else b'{}', 'application/json')
+        elif path == '/events':
+            self.send_events(pipeline.stats)
+        elif path == '/metrics':
+            self.send_bytes(json.dumps(pipeline.timer.summary()).encode('utf-8'), 'application/json')
+        else:
+            self.send_error(404)
+
+    def send_bytes(self, data, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream(self, broadcast, content_type, format_chunk):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        broadcast.connect()
+        try:
+            seq = 0
+            while self.server.pipeline.running:
+                seq, data = broadcast.wait(seq)
+                if data is not None:
+                    self.wfile.write(format_chunk(data))
+                    self.wfile.flush()
+        except OSError:  # 連線中斷或寫入逾時 (Python 3.9 的 socket.timeout 還不是 TimeoutError，但都是 OSError)
+            pass
+        finally:
+            broadcast.disconnect()
+
+    def send_mjpeg(self, broadcast):
+        self.stream(broadcast, 'multipart/x-mixed-replace; boundary=' + BOUNDARY, lambda data: b''.join([
+            b'--', BOUNDARY.encode(), b'\r\nContent-Type: image/jpeg\r\nContent-Length: ',
+            str(len(data)).encode(), b'\r\n\r\n', data, b'\r\n']))
+
+    # Server-Sent Events：每張影像一則 JSON
+    def send_events(self, broadcast):
+        self.stream(broadcast, 'text/event-stream', lambda data: b'data: ' + data + b'\n\n')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='無介面執行即時處理，以 HTTP 提供 MJPEG 影像與 JSON 統計')
+    parser.add_argument('source', nargs='?', default='0', help='影像來源，例如 0、file:a.mp4、synthetic:1920x1080')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    settings.add_pipeline_args(parser)
+    parser.add_argument('--quality', type=int, default=80, help='串流的 JPEG 品質')
+    parser.add_argument('--change-threshold', type=int, default=8,
+                        help='畫面變化超過此灰階差才重新處理，0 代表每張都處理')
+    parser.add_argument('--tiles', type=int, default=1, help='水平條帶平行處理的條數')
+    parser.add_argument('--measure', help='每張處理過的影像的量測紀錄 (.csv 或 .jsonl)')
+    parser.add_argument('--measure-max-mb', type=float, default=100, help='量測紀錄超過此大小時換新檔')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    params, rois, options = settings.resolve_params(args)
+    if not settings.check_blur([params[1]]):
+        return 2
+
+    source = create_source(args.source, args.width, args.height)
+    if not source.open():
+        print('無法開啟影像來源: %s' % args.source, file=sys.stderr)
+        return 1
+    measurements = MeasurementLog(args.measure, int(args.measure_max_mb * 1024 * 1024)) if args.measure else None
+    pipeline = HeadlessPipeline(source, params, rois, options['scale'], options['full_res_mean'], args.quality,
+                                change_threshold=args.change_threshold, tiles=args.tiles, measurements=measurements)
+    pipeline.start()
+
+    server = ThreadingHTTPServer((args.host, args.port), StreamHandler)
+    server.daemon_threads = True
+    server.pipeline = pipeline
+    print('http://%s:%d/' % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.stop()
+        server.server_close()
+        if measurements is not None:
+            measurements.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
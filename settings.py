@@ -0,0 +1,56 @@
+import json
+import sys
+
+PARAM_KEYS = ('binary', 'blur', 'dilate', 'erode')
+
+
+# 儲存處理參數、ROI 與其他選項 (例如縮小倍率 scale) 到 JSON 檔
+def save_settings(path, params, rois=(), options=None):
+    data = {
+        'params': dict(zip(PARAM_KEYS, (int(v) for v in params))),
+        'rois': [[int(v) for v in roi] for roi in rois],
+        'options': dict(options or {}),
+    }
+    with open(path, 'w', encoding='utf-8') as fp:
+        json.dump(data, fp, indent=2)
+
+
+# 讀取設定檔，回傳 (參數 tuple, ROI 清單, 選項 dict)，缺少的參數以 defaults 補上
+def load_settings(path, defaults=(128, 1, 1, 1)):
+    with open(path, encoding='utf-8') as fp:
+        data = json.load(fp)
+    params = data.get('params', {})
+    values = tuple(int(params.get(key, default)) for key, default in zip(PARAM_KEYS, defaults))
+    rois = [tuple(int(v) for v in roi) for roi in data.get('rois', [])]
+    return values, rois, data.get('options', {})
+
+
+# 命令列工具共用的處理參數 (batch、server、frame_archive replay)，搭配 resolve_params() 使用
+def add_pipeline_args(parser):
+    parser.add_argument('--binary', type=int, default=128)
+    parser.add_argument('--blur', type=int, default=1, help='高斯模糊 kernel，需為奇數')
+    parser.add_argument('--dilate', type=int, default=1)
+    parser.add_argument('--erode', type=int, default=1)
+    parser.add_argument('--scale', type=float, default=1, choices=[1, 0.5, 0.25, 0.125],
+                        help='縮小處理的倍率，外框會換算回原尺寸')
+    parser.add_argument('--no-full-res-mean', dest='full_res_mean', action='store_false',
+                        help='縮小處理時直接使用縮小影像計算均值')
+    parser.add_argument('--settings', help='從介面儲存的設定檔讀取參數與 ROI，會覆蓋上面的參數')
+
+
+# 依命令列參數與 --settings 設定檔決定 (參數 tuple, ROI 清單, 選項 dict)；設定檔缺少的項目沿用命令列的值
+def resolve_params(args):
+    params = (args.binary, args.blur, args.dilate, args.erode)
+    rois, options = [], {'scale': args.scale, 'full_res_mean': args.full_res_mean}
+    if args.settings:
+        params, rois, loaded = load_settings(args.settings, params)
+        options.update((key, loaded[key]) for key in ('scale', 'full_res_mean') if key in loaded)
+    return params, rois, options
+
+
+# 高斯模糊 kernel 必須為奇數，不符時印出錯誤並回傳 False，命令列工具以結束碼 2 結束
+def check_blur(blurs):
+    if any(blur % 2 == 0 for blur in blurs):
+        print('blur 必須為奇數', file=sys.stderr)
+        return False
+    return True
@@ -0,0 +1,157 @@
+import collections
+import multiprocessing
+import queue
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+import image_pipeline
+
+# 處理結果：影像與編號留在主行程，子行程只回傳處理後影像所在的位置與輪廓統計
+PoolResult = collections.namedtuple('PoolResult', 'seq frame_id frame img_process stats roi_stats latency error')
+
+LIVENESS_INTERVAL = 0.5  # 等待結果時最久這麼久檢查一次子行程是否還活著
+
+
+# 子行程：從共享記憶體讀取原圖，執行 handle_image 與輪廓統計，處理後的影像寫回共享記憶體
+def worker_process(tasks, results, input_name, output_name, frame_bytes, mask_bytes):
+    input_shm = shared_memory.SharedMemory(name=input_name)
+    output_shm = shared_memory.SharedMemory(name=output_name)
+    cv2.setNumThreads(1)  # 平行度由子行程數量決定，避免和 OpenCV 的執行緒互搶
+    cache = image_pipeline.PipelineCache()
+    roi_caches = {}
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            seq, slot, shape, frame_id, params, rois, with_mean, scale, full_res_mean = task
+            frame = np.ndarray(shape, np.uint8, input_shm.buf, slot * frame_bytes)
+            try:
+                if rois:
+                    roi_caches = {roi: c for roi, c in roi_caches.items() if roi in rois}
+                    img_process, roi_stats = image_pipeline.process_rois(frame, frame_id, params, rois, roi_caches,
+                                                                         with_mean, None, scale, full_res_mean)
+                    stats = np.concatenate(roi_stats)
+                else:
+                    img_process, stats = cache.analyze(frame, frame_id, params, with_mean, scale, full_res_mean)
+                    roi_stats = None
+                out = np.ndarray(img_process.shape, np.uint8, output_shm.buf, slot * mask_bytes)
+                out[...] = img_process
+                results.put((seq, img_process.shape, stats, roi_stats, None))
+                del out
+            except Exception as exc:
+                results.put((seq, None, None, None, repr(exc)))
+            # 快取中的影像指向共享記憶體，處理完就清掉，避免下一張覆寫後誤用
+            cache.clear()
+            for c in roi_caches.values():
+                c.clear()
+            del frame
+    finally:
+        input_shm.close()
+        output_shm.close()
+
+
+# 多行程處理：原圖複製到共享記憶體的環形槽位，子行程處理後只回傳小的描述資料，
+# 結果依送出順序取出；槽位全部使用中時 submit 回傳 None，由呼叫端決定丟棄或等待
+# 子行程異常結束時 (當機、記憶體不足) 它處理中的結果永遠不會回來：broken 設為 True，
+# 之後不再接受影像，尚未取回的影像都以 error 結果依序回傳，由呼叫端改回執行緒內處理
+class SharedFramePool:
+    def __init__(self, workers=2, max_shape=(1080, 1920, 3), slots=None):
+        self.slots = slots or workers * 2
+        self.max_shape = tuple(max_shape)
+        self.frame_bytes = int(np.prod(max_shape))
+        self.mask_bytes = int(max_shape[0] * max_shape[1])
+        self.input_shm = shared_memory.SharedMemory(create=True, size=self.slots * self.frame_bytes)
+        self.output_shm = shared_memory.SharedMemory(create=True, size=self.slots * self.mask_bytes)
+        self.free = collections.deque(range(self.slots))
+        self.pending = {}  # seq -> (slot, frame_id, frame, 送出時間)
+        self.done = {}  # seq -> 子行程的回傳，等待依序取出
+        self.next_seq = 0
+        self.next_out = 0
+        self.broken = False
+        self.closed = False
+
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.workers = [multiprocessing.Process(target=worker_process,
+                                                args=(self.tasks, self.results, self.input_shm.name,
+                                                      self.output_shm.name, self.frame_bytes, self.mask_bytes),
+                                                daemon=True)
+                        for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    # 影像是否放得進槽位
+    def fits(self, frame):
+        return frame.dtype == np.uint8 and frame.ndim == 3 and frame.nbytes <= self.frame_bytes \
+            and frame.shape[0] * frame.shape[1] <= self.mask_bytes
+
+    def has_free(self):
+        return len(self.free) > 0 and not self.broken
+
+    def in_flight(self):
+        return len(self.pending)
+
+    # 送出一張影像，回傳序號；沒有空的槽位或影像太大時回傳 None
+    def submit(self, frame, frame_id, params, rois=(), with_mean=True, scale=1, full_res_mean=True):
+        if not self.free or self.broken or not self.fits(frame):
+            return None
+        slot = self.free.popleft()
+        view = np.ndarray(frame.shape, np.uint8, self.input_shm.buf, slot * self.frame_bytes)
+        view[...] = frame
+        del view
+        seq = self.next_seq
+        self.next_seq += 1
+        self.pending[seq] = (slot, frame_id, frame, time.perf_counter())
+        self.tasks.put((seq, slot, frame.shape, frame_id, tuple(params), tuple(rois), with_mean, scale,
+                        full_res_mean))
+        return seq
+
+    # 依送出順序取出下一個結果，timeout 內下一個結果還沒完成時回傳 None
+    def get(self, timeout=None):
+        if self.next_out not in self.pending:
+            return None
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while self.next_out not in self.done and not self.broken:
+            remaining = LIVENESS_INTERVAL if deadline is None else max(0.0, deadline - time.perf_counter())
+            try:
+                seq, shape, stats, roi_stats, error = self.results.get(timeout=min(remaining, LIVENESS_INTERVAL))
+            except queue.Empty:
+                if any(not worker.is_alive() for worker in self.workers):
+                    self.broken = True
+                elif deadline is not None and time.perf_counter() >= deadline:
+                    return None
+                continue
+            self.done[seq] = (shape, stats, roi_stats, error)
+
+        seq = self.next_out
+        self.next_out += 1
+        slot, frame_id, frame, start = self.pending.pop(seq)
+        if seq not in self.done:
+            # 槽位不再使用：還活著的子行程可能仍在寫入
+            return PoolResult(seq, frame_id, frame, None, None, None, time.perf_counter() - start,
+                              'worker process exited')
+        shape, stats, roi_stats, error = self.done.pop(seq)
+        img_process = None
+        if error is None:
+            img_process = np.ndarray(shape, np.uint8, self.output_shm.buf, slot * self.mask_bytes).copy()
+        self.free.append(slot)
+        return PoolResult(seq, frame_id, frame, img_process, stats, roi_stats, time.perf_counter() - start, error)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(timeout=2)
+            if worker.is_alive():
+                worker.terminate()
+        self.input_shm.close()
+        self.input_shm.unlink()
+        self.output_shm.close()
+        self.output_shm.unlink()
@@ -0,0 +1,343 @@
+import glob
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from frame_archive import FrameArchive
+
+VIDEO_EXTS = ('.mp4', '.avi', '.mkv', '.mov', '.wmv')
+PROBE_MODES = [(640, 480), (1280, 720), (1920, 1080), (3840, 2160)]  # 偵測相機時嘗試的解析度
+
+
+# 依作業系統選擇相機後端
+def default_backend():
+    if sys.platform.startswith('win'):
+        return cv2.CAP_DSHOW
+    if sys.platform.startswith('linux'):
+        return cv2.CAP_V4L2
+    if sys.platform == 'darwin':
+        return cv2.CAP_AVFOUNDATION
+    return cv2.CAP_ANY
+
+
+# 影像來源的共同介面，和 cv2.VideoCapture 一樣提供 isOpened / read / release
+class FrameSource:
+    name = 'source'
+
+    def open(self):
+        return self.isOpened()
+
+    def isOpened(self):
+        return False
+
+    def read(self):
+        return False, None
+
+    def release(self):
+        pass
+
+    # 影像的實際速率 (每秒張數)，未知時回傳 0
+    def frame_rate(self):
+        return 0.0
+
+
+# 依照 fps 控制讀取速度，模擬即時影像
+class _Pacer:
+    def __init__(self, fps):
+        self.interval = 1.0 / fps if fps and fps > 0 else 0.0
+        self.next_time = 0.0
+
+    def wait(self):
+        if self.interval <= 0:
+            return
+        now = time.perf_counter()
+        if self.next_time > now:
+            time.sleep(self.next_time - now)
+        self.next_time = max(now, self.next_time) + self.interval
+
+
+# 相機，backend 為 None 時依作業系統選擇
+class CameraSource(FrameSource):
+    def __init__(self, index=0, width=1920, height=1080, fps=24, backend=None):
+        self.index = index
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.backend = default_backend() if backend is None else backend
+        self.name = 'cam:%d' % index
+        self.cap = None
+
+    def open(self):
+        self.cap = cv2.VideoCapture(self.index, self.backend)
+        if self.cap.isOpened():
+            set_pixels(self.cap, self.width, self.height, self.fps)
+        return self.cap.isOpened()
+
+    def isOpened(self):
+        return self.cap is not None and self.cap.isOpened()
+
+    def read(self):
+        return self.cap.read()
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+
+    # 部分後端取不到 fps (回傳 0)，改用要求的設定值
+    def frame_rate(self):
+        fps = self.cap.get(cv2.CAP_PROP_FPS) if self.isOpened() else 0
+        return fps if fps > 0 else float(self.fps)
+
+
+# 影片檔，realtime 時依影片 fps 播放，loop 時播完從頭開始
+class VideoFileSource(FrameSource):
+    def __init__(self, path, loop=True, realtime=True):
+        self.path = path
+        self.loop = loop
+        self.realtime = realtime
+        self.name = 'file:' + os.path.basename(path)
+        self.cap = None
+        self.pacer = None
+
+    def open(self):
+        self.cap = cv2.VideoCapture(self.path)
+        self.pacer = _Pacer(self.cap.get(cv2.CAP_PROP_FPS) if self.realtime else 0)
+        return self.cap.isOpened()
+
+    def isOpened(self):
+        return self.cap is not None and self.cap.isOpened()
+
+    def read(self):
+        self.pacer.wait()
+        ret, frame = self.cap.read()
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        return ret, frame
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+
+    def frame_rate(self):
+        return self.cap.get(cv2.CAP_PROP_FPS) if self.isOpened() and self.realtime else 0.0
+
+
+# 影像序列 (目錄或萬用字元)，以固定 fps 依序讀取
+class ImageSequenceSource(FrameSource):
+    def __init__(self, pattern, fps=10, loop=True):
+        self.pattern = pattern
+        self.fps = fps
+        self.loop = loop
+        self.name = 'images:' + pattern
+        self.paths = []
+        self.index = 0
+        self.pacer = _Pacer(fps)
+
+    def open(self):
+        if os.path.isdir(self.pattern):
+            self.paths = sorted(os.path.join(self.pattern, name) for name in os.listdir(self.pattern)
+                                if name.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')))
+        else:
+            self.paths = sorted(glob.glob(self.pattern))
+        self.index = 0
+        return self.isOpened()
+
+    def isOpened(self):
+        return len(self.paths) > 0 and (self.loop or self.index < len(self.paths))
+
+    def read(self):
+        if not self.isOpened():
+            return False, None
+        self.pacer.wait()
+        path = self.paths[self.index % len(self.paths)]
+        self.index += 1
+        if self.loop:
+            self.index %= len(self.paths)
+        frame = cv2.imread(path)
+        return frame is not None, frame
+
+    def frame_rate(self):
+        return float(self.fps)
+
+
+# 合成影像：暗色背景上有幾個移動的亮色方塊，不需要相機也能測試
+class SyntheticSource(FrameSource):
+    def __init__(self, width=1920, height=1080, fps=24, objects=4, seed=0):
+        self.width = width
+        self.height = height
+        self.objects = objects
+        self.name = 'synthetic:%dx%d' % (width, height)
+        self.fps = fps
+        self.pacer = _Pacer(fps)
+        self.rng = np.random.default_rng(seed)
+        self.opened = False
+        self.tick = 0
+        self.background = None
+        self.boxes = None
+
+    def open(self):
+        self.background = (self.rng.random((self.height, self.width, 3)) * 40).astype(np.uint8)
+        size = np.array([self.width, self.height])
+        self.boxes = [(self.rng.random(2) * size * 0.8, (self.rng.random(2) - 0.5) * size * 0.02,
+                       (self.rng.random(2) * 0.1 + 0.05) * size) for _ in range(self.objects)]
+        self.opened = True
+        return True
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        if not self.opened:
+            return False, None
+        self.pacer.wait()
+        self.tick += 1
+        frame = self.background.copy()
+        for position, velocity, box_size in self.boxes:
+            x, y = (position + velocity * self.tick) % (np.array([self.width, self.height]) - box_size)
+            cv2.rectangle(frame, (int(x), int(y)), (int(x + box_size[0]), int(y + box_size[1])),
+                          (200, 200, 200), -1)
+        return True, frame
+
+    def release(self):
+        self.opened = False
+
+    def frame_rate(self):
+        return float(self.fps)
+
+
+# 封存檔當作影像來源：依原本的時間間隔乘上 speed 播放，speed 為 0 時以最快速度讀取；
+# seek() 可在播放中跳到任一張
+class ArchiveSource(FrameSource):
+    def __init__(self, path, speed=1.0, loop=True):
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.name = 'archive:' + os.path.basename(path)
+        self.archive = None
+        self.position = 0  # 下一張要讀取的影像編號
+        self.lock = threading.Lock()
+        self.anchor = None  # (影像編號, 當時的時間)，播放時間以此為基準
+
+    def open(self):
+        archive = FrameArchive(self.path)
+        with self.lock:
+            self.archive = archive
+            self.position = 0
+            self.anchor = None
+        return self.isOpened()
+
+    def isOpened(self):
+        return self.archive is not None and len(self.archive) > 0 \
+            and (self.loop or self.position < len(self.archive))
+
+    def seek(self, index):
+        with self.lock:
+            if self.archive is None:
+                return
+            self.position = min(max(int(index), 0), len(self.archive) - 1)
+            self.anchor = None
+
+    def set_speed(self, speed):
+        with self.lock:
+            self.speed = speed
+            self.anchor = None
+
+    # release() 可能在等待播放時間時被呼叫，鎖外只使用取出的 archive
+    def read(self):
+        with self.lock:
+            archive = self.archive
+            if not self.isOpened():
+                return False, None
+            if self.position >= len(archive):
+                self.position = 0
+                self.anchor = None
+            index = self.position
+            self.position += 1
+            if self.anchor is None:
+                self.anchor = (index, time.perf_counter())
+            anchor_index, anchor_time = self.anchor
+            speed = self.speed
+        if speed > 0:
+            timestamps = archive.timestamps
+            delay = anchor_time + (timestamps[index] - timestamps[anchor_index]) / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        return True, archive[index]
+
+    def release(self):
+        with self.lock:
+            self.archive = None
+
+    # 錄影時的平均速率乘上播放速度，最快速度播放時為未知
+    def frame_rate(self):
+        with self.lock:
+            archive, speed = self.archive, self.speed
+        if archive is None or speed <= 0 or archive.duration() <= 0:
+            return 0.0
+        return (len(archive) - 1) / archive.duration() * speed
+
+
+# 設定相機解析度，和目前設定相同的項目不再設定 (每次設定都可能讓驅動重新協商格式，相當耗時)
+def set_pixels(cap, width, height, fps):
+    if cap.get(cv2.CAP_PROP_FRAME_WIDTH) != width or cap.get(cv2.CAP_PROP_FRAME_HEIGHT) != height:
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    if cap.get(cv2.CAP_PROP_FPS) != fps:
+        cap.set(cv2.CAP_PROP_FPS, fps)  # FPS
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # 驅動端只保留一張，避免累積過時的影像
+
+
+# 偵測可用的相機與支援的解析度，skip 為使用中的相機編號；
+# 回傳 [{'index', 'backend', 'modes': [(寬, 高, fps), ...]}]
+def probe_cameras(max_index=4, backend=None, skip=(), modes=PROBE_MODES):
+    backend = default_backend() if backend is None else backend
+    devices = []
+    for index in range(max_index):
+        if index in skip:
+            continue
+        cap = cv2.VideoCapture(index, backend)
+        try:
+            if not cap.isOpened():
+                continue
+            found = []
+            for width, height in modes:
+                cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+                cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+                mode = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                        cap.get(cv2.CAP_PROP_FPS))
+                if mode not in found:
+                    found.append(mode)
+            devices.append({'index': index, 'backend': cap.getBackendName(), 'modes': found})
+        finally:
+            cap.release()
+    return devices
+
+
+# 由字串建立影像來源：
+#   0 / cam:0               相機
+#   file:a.mp4 / a.mp4      影片檔
+#   images:dir 或 *.png     影像序列
+#   synthetic:1920x1080     合成影像
+#   archive:a.raw           原始影像封存檔 (frame_archive.py)
+def create_source(spec, width=1920, height=1080, fps=24):
+    spec = str(spec)
+    kind, _, value = spec.partition(':')
+    if kind not in ('cam', 'file', 'images', 'synthetic', 'archive'):
+        kind, value = '', spec
+    if kind == 'cam' or (kind == '' and value.isdigit()):
+        return CameraSource(int(value), width, height, fps)
+    if kind == 'file' or (kind == '' and value.lower().endswith(VIDEO_EXTS)):
+        return VideoFileSource(value)
+    if kind == 'images' or kind == '':
+        return ImageSequenceSource(value)
+    if kind == 'archive':
+        return ArchiveSource(value)
+    if kind == 'synthetic':
+        size = value.lower().split('x') if value else (width, height)
+        return SyntheticSource(int(size[0]), int(size[1]), fps)
+    raise ValueError('unknown source: %s' % spec)
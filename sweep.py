@@ -0,0 +1,196 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import image_pipeline
+import settings
+from batch import collect_images, process_pool
+
+COARSE_STRIDES = (16, 1, 5, 5)  # refine 搜尋第一輪在各參數上的間隔
+MISSING_MEAN = 255.0  # 預期有均值但沒有找到輪廓時的均值誤差
+
+_REFERENCE = {}  # 子行程中最近使用的參考影像，同一張影像的任務連續送進來時不必重新讀取
+
+
+# 參數範圍：a:b[:step] (不含 b，和 range 相同) 或逗號分隔的清單
+def parse_values(text):
+    if ':' in text:
+        return list(range(*[int(v) for v in text.split(':')]))
+    return [int(v) for v in text.split(',') if v]
+
+
+# 預期值檔案：{"影像檔名": {"count": 輪廓數, "mean": 總均值}}，兩個欄位都可省略
+def load_expected(path):
+    with open(path, encoding='utf-8') as fp:
+        return {os.path.basename(name): value for name, value in json.load(fp).items()}
+
+
+# 讀取參考影像：縮小後的灰階影像供處理，原圖的積分圖供計算均值
+def load_reference(path, scale):
+    key = (path, scale)
+    if key not in _REFERENCE:
+        frame = cv2.imread(path)
+        if frame is None:
+            raise ValueError('cannot read image: %s' % path)
+        small = image_pipeline.downscale(frame, scale) if scale != 1 else frame
+        _REFERENCE.clear()
+        _REFERENCE[key] = (cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), cv2.integral(frame, sdepth=cv2.CV_64F),
+                           small.shape, frame.shape)
+    return _REFERENCE[key]
+
+
+# 子行程：同一個二值化門檻底下的所有 模糊 x 膨脹 x 侵蝕 組合，
+# 共用前面階段的結果 (二值化一次、每個模糊一次、每個膨脹一次)，回傳每個組合和預期值的誤差
+def evaluate_prefix(task):
+    path, scale, binary, blurs, dilates, erodes, expected, count_weight, mean_weight = task
+    gray, integral, small_shape, full_shape = load_reference(path, scale)
+    errors = np.zeros((len(blurs), len(dilates), len(erodes)))
+    binary_frame = cv2.threshold(gray, binary, 255, cv2.THRESH_BINARY)[1]
+    for i, blur in enumerate(blurs):
+        img_blur = cv2.GaussianBlur(binary_frame, (blur, blur), 10)
+        for j, dilate in enumerate(dilates):
+            img_dilate = cv2.dilate(img_blur, image_pipeline.morph_kernel(dilate), iterations=1)
+            for k, erode in enumerate(erodes):
+                img_erode = cv2.erode(img_dilate, image_pipeline.morph_kernel(erode), iterations=1)
+                stats = image_pipeline.contour_stats(gray, img_erode, with_mean=False)
+                error = 0.0
+                if 'count' in expected:
+                    error += count_weight * abs(len(stats) - expected['count'])
+                if 'mean' in expected:
+                    if len(stats) == 0:
+                        error += mean_weight * MISSING_MEAN
+                    else:
+                        if scale != 1:
+                            stats = image_pipeline.upscale_stats(stats, small_shape, full_shape)
+                        mean = image_pipeline.integral_means(integral, stats).mean()
+                        error += mean_weight * abs(mean - expected['mean'])
+                errors[i, j, k] = error
+    return errors
+
+
+# 相同結果的參數只算一次：二值化門檻之間沒有任何灰階值時二值化結果相同，
+# 縮小處理時不同的 kernel 也可能縮成相同的大小；回傳 (不重複的值, 每個原始值對應的位置)
+def unique_values(values):
+    unique = sorted(set(values))
+    return unique, np.array([unique.index(v) for v in values])
+
+
+def binary_classes(gray, thresholds):
+    cumulative = np.cumsum(np.bincount(gray.ravel(), minlength=256))
+    classes = {}
+    for index, threshold in enumerate(thresholds):
+        key = int(cumulative[min(max(threshold, 0), 255)])
+        classes.setdefault(key, (threshold, []))[1].append(index)
+    return list(classes.values())
+
+
+# 評估一組參數網格，回傳每個組合在所有參考影像上的誤差總和 (形狀為各參數的數量)
+def evaluate_grid(pool, references, axes, scale, count_weight, mean_weight):
+    binaries, blurs, dilates, erodes = axes
+    blur_u, blur_map = unique_values([image_pipeline.scale_params(0, v, 0, 0, scale)[1] for v in blurs])
+    dilate_u, dilate_map = unique_values([image_pipeline.scale_params(0, 1, v, 0, scale)[2] for v in dilates])
+    erode_u, erode_map = unique_values([image_pipeline.scale_params(0, 1, 0, v, scale)[3] for v in erodes])
+
+    tasks, members = [], []
+    for path, expected in references:
+        gray = load_reference(path, scale)[0]
+        for threshold, indexes in binary_classes(gray, binaries):
+            tasks.append((path, scale, threshold, blur_u, dilate_u, erode_u, expected, count_weight, mean_weight))
+            members.append(indexes)
+
+    scores = np.zeros([len(v) for v in axes])
+    grid = np.ix_(blur_map, dilate_map, erode_map)
+    for indexes, errors in zip(members, pool.map(evaluate_prefix, tasks)):
+        scores[indexes] += errors[grid]
+    return scores, len(tasks) * len(blur_u) * len(dilate_u) * len(erode_u)
+
+
+# 以最佳值為中心、間隔減半，縮小搜尋範圍
+def refine_axes(full_axes, best, strides):
+    axes = []
+    for values, value, stride in zip(full_axes, best, strides):
+        center = values.index(value)
+        low, high = max(0, center - stride), min(len(values) - 1, center + stride)
+        step = max(1, stride // 2)
+        indexes = sorted(set(range(center, low - 1, -step)) | set(range(center, high + 1, step)))
+        axes.append([values[i] for i in indexes])
+    return axes
+
+
+# 列出最佳幾組參數在每張參考影像上的輪廓數與均值
+def report(references, candidates, scale):
+    for rank, (score, params) in enumerate(candidates, 1):
+        print('#%d  binary=%d blur=%d dilate=%d erode=%d  score=%.2f' % ((rank,) + tuple(params) + (score,)))
+        for path, expected in references:
+            _, stats = image_pipeline.analyze(cv2.imread(path), params, scale)
+            mean = image_pipeline.total_mean(stats)
+            print('    %-40s count %4d (expected %4s)  mean %7s (expected %s)' % (
+                os.path.basename(path), len(stats), expected.get('count', '-'),
+                '-' if mean is None else '%.2f' % mean, expected.get('mean', '-')))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='在參考影像上搜尋最接近預期輪廓數與均值的處理參數')
+    parser.add_argument('inputs', nargs='+', help='參考影像目錄或萬用字元')
+    parser.add_argument('--expected', required=True, help='預期值 JSON：{"檔名": {"count": 3, "mean": 180.5}}')
+    parser.add_argument('-o', '--output', default='sweep_settings.json', help='最佳參數輸出成介面可載入的設定檔')
+    parser.add_argument('--binary', default='0:256', help='二值化門檻，a:b[:step] 或逗號清單')
+    parser.add_argument('--blur', default='1:16:2', help='高斯模糊 kernel (奇數)')
+    parser.add_argument('--dilate', default='1:51')
+    parser.add_argument('--erode', default='1:51')
+    parser.add_argument('--search', choices=['grid', 'refine'], default='grid',
+                        help='grid 評估所有組合；refine 先粗略搜尋再逐步縮小範圍')
+    parser.add_argument('--scale', type=float, default=1, choices=[1, 0.5, 0.25, 0.125],
+                        help='縮小處理的倍率，同時寫入設定檔')
+    parser.add_argument('--count-weight', type=float, default=10, help='每差一個輪廓的誤差')
+    parser.add_argument('--mean-weight', type=float, default=1, help='均值每差 1 的誤差')
+    parser.add_argument('--top', type=int, default=5, help='列出最佳的幾組參數')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='子行程數量')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    expected = load_expected(args.expected)
+    references = [(path, expected[os.path.basename(path)]) for path in collect_images(args.inputs)
+                  if os.path.basename(path) in expected]
+    if not references:
+        print('沒有任何影像在預期值檔案中', file=sys.stderr)
+        return 2
+    full_axes = [parse_values(args.binary), parse_values(args.blur), parse_values(args.dilate),
+                 parse_values(args.erode)]
+    if not settings.check_blur(full_axes[1]):
+        return 2
+    start = time.perf_counter()
+    strides = COARSE_STRIDES if args.search == 'refine' else (1, 1, 1, 1)
+    axes = [values[::stride] for values, stride in zip(full_axes, strides)]
+    with process_pool(args.workers) as pool:
+        while True:
+            scores, evaluated = evaluate_grid(pool, references, axes, args.scale, args.count_weight,
+                                              args.mean_weight)
+            candidates = []
+            for i in np.argsort(scores, axis=None, kind='stable')[:args.top]:
+                position = np.unravel_index(i, scores.shape)
+                candidates.append((float(scores.flat[i]), tuple(axis[j] for axis, j in zip(axes, position))))
+            print('%s: %d combinations, %d evaluated, %.1f s' % (
+                'x'.join(str(len(a)) for a in axes), scores.size, evaluated, time.perf_counter() - start),
+                file=sys.stderr)
+            if max(strides) == 1:
+                break
+            axes = refine_axes(full_axes, candidates[0][1], strides)
+            strides = tuple(max(1, stride // 2) for stride in strides)
+
+    report(references, candidates, args.scale)
+    best = candidates[0][1]
+    settings.save_settings(args.output, best, options={'scale': args.scale})
+    print('best settings -> %s' % args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())